@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+#The count column of a grid as numbers (blank or non-numeric cells count as 0)
+def numeric_counts(grid):
+    return pd.to_numeric(pd.Series(grid.counts, dtype=object), errors='coerce').fillna(0).to_numpy()
+
+#Rows with a name (skips blank rows at the bottom of a worksheet)
+def named_rows(grid):
+    return np.array([name.strip() != '' for name in grid.names], dtype=bool)
+
+#The number required by a requirement sheet's count header, e.g. "Completed (3)" -> 3 (None if it isn't a number)
+def required_count(grid):
+    try:
+        return float(grid.headers[1].split('(')[1].rstrip(')'))
+    except (IndexError, ValueError):
+        return None
+
+#Whole-roster view of one requirement worksheet: completion rate & who is behind, fewest completed first
+def requirement_summary(grid):
+    named = named_rows(grid)
+    counts = numeric_counts(grid)
+    required = required_count(grid)
+    total = int(named.sum())
+    if required is None:
+        behind = np.zeros(len(grid), dtype=bool)
+    else:
+        behind = named & (counts < required)
+    order = np.flatnonzero(behind)[np.argsort(counts[behind], kind='stable')]
+    return {
+        'required': required,
+        'members': total,
+        'completed': total - int(behind.sum()),
+        'completion_rate': (total - int(behind.sum())) / total if total else 0.0,
+        'behind': [(grid.names[i].strip(), counts[i]) for i in order],
+    }
+
+#Whole-roster view of an attendance worksheet: who is at or over the absence limit (most absences first)
+#and each event's attendance rate among the people marked either way
+def absence_summary(grid, limit):
+    named = named_rows(grid)
+    counts = numeric_counts(grid)
+    over = named & (counts >= limit)
+    order = np.flatnonzero(over)[np.argsort(-counts[over], kind='stable')]
+
+    width = len(grid.columns)
+    attended = np.unpackbits(grid.true[named], axis=1, count=width).sum(axis=0)
+    missed = np.unpackbits(grid.false[named], axis=1, count=width).sum(axis=0)
+    marked = attended + missed
+    rates = np.divide(attended, marked, out=np.zeros(width), where=marked > 0)
+    #Least attended first, ignoring events nobody has been marked for yet
+    events = np.flatnonzero(marked > 0)
+    events = events[np.argsort(rates[events], kind='stable')]
+    return {
+        'limit': limit,
+        'members': int(named.sum()),
+        'average': float(counts[named].mean()) if named.any() else 0.0,
+        'over_limit': [(grid.names[i].strip(), counts[i]) for i in order],
+        'attendance_rates': [(grid.columns[i], float(rates[i])) for i in events],
+    }
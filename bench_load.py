@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import resource
+import string
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+#End-to-end load test: replays Slack message events through the bot's /slack/events endpoint at a fixed concurrency,
+#with Google Sheets and the Slack Web API replaced by local stand-ins (fakes.py) that add latency & rate limits
+#Reports p50/p95/p99 time-to-reply per intent, external calls per request and memory use
+#Usage: python bench_load.py --requests 200 --concurrency 8 --sheets-latency 0.15 --slack-latency 0.05
+#       python bench_load.py --corpus messages.jsonl --json after.json --compare before.json
+
+SECRET = 'bench-signing-secret'
+ROSTER_ID = 'benchRoster'
+EVENTS_ID = 'benchEvents'
+PLACEHOLDER = "Give me a few seconds to fetch the data..."
+CATEGORIES = ['Service', 'Professional', 'Fundraising', 'Rush']
+
+#Names that never contain one another, so every member matches exactly one Slack user
+def member_names(count):
+    codes = (''.join(letters) for letters in itertools.product(string.ascii_lowercase, repeat=3))
+    return [f"M{code} Z{code}" for code in itertools.islice(codes, count)]
+
+def ordinal(day):
+    suffix = 'th' if 10 <= day % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
+    return f"{day}{suffix}"
+
+def checkbox_sheet(names, header, columns, rng, trailing=None):
+    rows = [['Name', header] + columns + ([trailing] if trailing else [])]
+    for name in names:
+        marks = [rng.choice(['TRUE', 'FALSE']) for _ in columns]
+        count = marks.count('FALSE' if trailing else 'TRUE')
+        rows.append([name, str(count)] + marks + ([str(count)] if trailing else []))
+    return rows
+
+def roster_worksheets(names, events, rng):
+    today = date.today()
+    worksheets = {}
+    for category in CATEGORIES:
+        worksheets[f"{category} Requirements"] = checkbox_sheet(names, 'Completed (3)', [f"{category} event {i}" for i in range(events)], rng)
+    meetings = [(today - timedelta(days=7 * i)).strftime('%-m/%-d') for i in range(events)][::-1]
+    worksheets['Chapter Attendance'] = checkbox_sheet(names, 'Absences', meetings, rng, trailing='Total')
+    worksheets['Ritual Attendance'] = checkbox_sheet(names, 'Absences', [f"Ritual {i}" for i in range(events // 4 + 1)], rng, trailing='Total')
+    worksheets['Active Members'] = [['First', 'Last', 'Email', 'Phone', 'Birthday']] + [
+        name.split() + ['', '', (today + timedelta(days=i)).strftime('%B ') + ordinal((today + timedelta(days=i)).day)] for i, name in enumerate(names)]
+    return worksheets
+
+def calendar_worksheet(events):
+    today = date.today()
+    rows = [['Month', 'Date', 'Time', 'Event', 'Location', 'Notes'], ['', '', '', '', '', '']]
+    for i in range(events):
+        day = today + timedelta(days=3 * i - events)
+        rows.append([day.strftime('%B'), ordinal(day.day), '7:00 PM', f"Chapter event {i}", 'Zoom' if i % 3 == 0 else 'Student Union', ''])
+    return rows
+
+DEFAULT_MESSAGES = [
+    "What are the upcoming events?",
+    "How many service requirements have I completed?",
+    "what requirements do I need",
+    "How many rituals have I missed?",
+    "how many chapter meetings have I missed",
+    "what is today's event",
+    "can I get the zoom link",
+    "send me the budget sheet",
+    "thanks!!",
+    "good morning",
+    "hello there",
+    "what's the weather like",
+]
+
+#Message texts from a JSONL file: each line is a Slack event payload, an event, or any object with a "text"
+def load_corpus(path):
+    texts = []
+    with open(path) as corpus:
+        for line in corpus:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item = item.get('event', item)
+            text = item.get('text') or item.get('body') or item.get('title')
+            if text:
+                texts.append(text)
+    return texts
+
+def sign(body, timestamp):
+    return 'v0=' + hmac.new(SECRET.encode(), f"v0:{timestamp}:{body}".encode(), hashlib.sha256).hexdigest()
+
+def percentiles(values):
+    if not values:
+        return [float('nan')] * 3
+    return [float(value) for value in np.percentile(values, [50, 95, 99])]
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=20, help='requests sent (and not measured) before the run')
+    parser.add_argument('--corpus', help='JSONL file of messages to replay (defaults to a built-in set)')
+    parser.add_argument('--members', type=int, default=60)
+    parser.add_argument('--events', type=int, default=40)
+    parser.add_argument('--sheets-latency', type=float, default=0.15, help='seconds per simulated Sheets request')
+    parser.add_argument('--sheets-rate-limit', type=float, default=None, help='Sheets requests per second')
+    parser.add_argument('--slack-latency', type=float, default=0.05, help='seconds per simulated Slack call')
+    parser.add_argument('--slack-rate-limit', type=int, default=None, help='Slack calls per second per method before 429s')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for the last reply')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file from an earlier run; exit non-zero if any p95 got worse')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown when comparing (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    project = os.path.dirname(os.path.abspath(__file__))
+    #Paths are relative to where the benchmark was started, not the scratch directory the bot runs in
+    corpus, output_path, compare_path = [os.path.abspath(path) if path else None for path in (args.corpus, args.json, args.compare)]
+    sys.path.insert(0, project)
+    from fakes import FakeSheetsClient, FakeSlackServer
+
+    rng = random.Random(0)
+    names = member_names(args.members)
+    users = [(f"U{i:05d}", name) for i, name in enumerate(names)]
+    sheets = FakeSheetsClient(latency=args.sheets_latency, rate_limit=args.sheets_rate_limit)
+    sheets.add_spreadsheet(ROSTER_ID, roster_worksheets(names, args.events, rng))
+    sheets.add_spreadsheet(EVENTS_ID, {'Semester Calendar': calendar_worksheet(args.events)})
+    slack = FakeSlackServer(users, latency=args.slack_latency, rate_limit=args.slack_rate_limit)
+
+    #Run the bot in a scratch directory so it gets its own database.db
+    os.chdir(tempfile.mkdtemp(prefix='bench-load-'))
+    os.environ.update(SLACK_SIGNING_SECRET=SECRET, SLACK_BOT_TOKEN='xoxb-bench', SLACK_BOT_USER_ID='UBOT', BOT_SCHEDULER='off', REQUEST_LOG='off')
+    rss_before = max_rss_mb()
+    import bot
+    from lazy import Lazy
+    bot.sa = Lazy(lambda: sheets)
+    chapter = bot.tenants.default_tenant()
+    chapter.client.base_url = slack.base_url
+    chapter.links.set('roster_url', f"https://docs.google.com/spreadsheets/d/{ROSTER_ID}/edit")
+    chapter.links.set('events_url', f"https://docs.google.com/spreadsheets/d/{EVENTS_ID}/edit")
+    chapter.links.set('budget_url', "https://docs.google.com/spreadsheets/d/benchBudget/edit")
+
+    texts = load_corpus(corpus) if corpus else DEFAULT_MESSAGES
+    counter = itertools.count()
+
+    #POST one signed message event and return (channel, text, time sent, status)
+    def send(text):
+        i = next(counter)
+        channel = f"CLOAD{i}"
+        event = {'type': 'message', 'channel': channel, 'user': users[i % len(users)][0], 'text': text, 'ts': f"{1700000000 + i}.000100"}
+        body = json.dumps({'type': 'event_callback', 'event_id': f"Ev{i}", 'event': event})
+        timestamp = str(int(time.time()))
+        started = time.monotonic()
+        response = bot.app.test_client().post('/slack/events', data=body, content_type='application/json',
+                                              headers={'X-Slack-Request-Timestamp': timestamp, 'X-Slack-Signature': sign(body, timestamp)})
+        return channel, text, started, time.monotonic() - started, response.status_code
+
+    #Time of the last real reply (not the placeholder) in each channel
+    def replies():
+        last = {}
+        for sent_at, _, arguments in list(slack.messages):
+            if arguments.get('text') != PLACEHOLDER:
+                last[arguments.get('channel')] = sent_at
+        return last
+
+    def run(count):
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            sent = list(pool.map(send, [texts[i % len(texts)] for i in range(count)]))
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and len(replies()) < sum(1 for *_, status in sent if status == 200):
+            time.sleep(0.05)
+        #Let stragglers (e.g. a chat.update after a placeholder) land
+        time.sleep(max(args.slack_latency * 2, 0.1))
+        return sent
+
+    if args.warmup:
+        run(args.warmup)
+    sheets.reset_calls()
+    slack.reset_calls()
+    started = time.monotonic()
+    sent = run(args.requests)
+    elapsed = time.monotonic() - started
+    last = replies()
+
+    by_intent = {}
+    acks = []
+    rejected = 0
+    unanswered = 0
+    for channel, text, sent_at, ack, status in sent:
+        acks.append(ack)
+        if status != 200:
+            rejected += 1
+            continue
+        intent = bot.intent_router.route(text) or 'unknown'
+        if channel not in last:
+            unanswered += 1
+            continue
+        by_intent.setdefault(intent, []).append(last[channel] - sent_at)
+
+    results = {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'throughput': args.requests / elapsed,
+        'ack': dict(zip(['p50', 'p95', 'p99'], percentiles(acks))),
+        'intents': {intent: dict(zip(['p50', 'p95', 'p99'], percentiles(latencies)), n=len(latencies)) for intent, latencies in sorted(by_intent.items())},
+        'sheets_calls_per_request': {name: calls / args.requests for name, calls in sorted(sheets.calls.items())},
+        'slack_calls_per_request': {name: calls / args.requests for name, calls in sorted(slack.calls.items())},
+        'slack_rate_limited': slack.rate_limited,
+        'rejected': rejected,
+        'unanswered': unanswered,
+        'max_rss_mb': max_rss_mb(),
+        'rss_growth_mb': max_rss_mb() - rss_before,
+    }
+
+    print(f"{args.requests} requests at concurrency {args.concurrency}: {results['throughput']:.1f} req/s, "
+          f"{rejected} rejected (503), {unanswered} without a reply")
+    print(f"Sheets {args.sheets_latency * 1000:.0f} ms/request, Slack {args.slack_latency * 1000:.0f} ms/call")
+    print(f"\n{'intent':22}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print(f"{'(event ack)':22}{len(acks):5}" + ''.join(f"{value * 1000:10.1f}" for value in results['ack'].values()))
+    for intent, stats in results['intents'].items():
+        print(f"{intent:22}{stats['n']:5}" + ''.join(f"{stats[key] * 1000:10.1f}" for key in ('p50', 'p95', 'p99')))
+    print("\nexternal calls per request:")
+    for name, calls in {**{f"sheets {k}": v for k, v in results['sheets_calls_per_request'].items()},
+                        **{f"slack {k}": v for k, v in results['slack_calls_per_request'].items()}}.items():
+        print(f"  {name:30}{calls:8.3f}")
+    print(f"slack 429s: {slack.rate_limited}")
+    print(f"\nmemory: max RSS {results['max_rss_mb']:.1f} MB ({results['rss_growth_mb']:+.1f} MB since start)")
+
+    if output_path:
+        with open(output_path, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if compare_path:
+        with open(compare_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = [(intent, baseline['intents'][intent]['p95'], stats['p95']) for intent, stats in results['intents'].items()
+                       if intent in baseline['intents'] and stats['p95'] > baseline['intents'][intent]['p95'] * (1 + args.tolerance)]
+        for intent, before, after in regressions:
+            print(f"REGRESSION {intent}: p95 {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
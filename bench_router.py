@@ -0,0 +1,143 @@
+import argparse
+import random
+import time
+
+from better_profanity import profanity
+
+from router import INTENTS, IntentRouter
+
+#Micro-benchmark of intent routing: the old if/elif chain of in_list() calls vs the compiled IntentRouter
+#Usage: python bench_router.py --synthetic 500 --rounds 3
+
+MESSAGES = [
+    "What are the upcoming events?",
+    "any upcoming chapter events this week",
+    "How many service requirements have I completed?",
+    "what credits do I need",
+    "which requirements have i done so far",
+    "who is behind on requirements",
+    "send me the absence report",
+    "How many rituals have I missed?",
+    "how many chapter meetings have I missed",
+    "which events have i attended",
+    "what is today's event",
+    "where is todays chapter event",
+    "when is the event today?",
+    "can I get the zoom link",
+    "mailtime",
+    "send me the budget sheet",
+    "update the roster: <https://docs.google.com/spreadsheets/d/abc/edit>",
+    "update events calendar: <https://docs.google.com/spreadsheets/d/def/edit>",
+    "thanks!!",
+    "ty bot",
+    "tell me a joke",
+    "give me a random fact",
+    "bye",
+    "goodnight everyone",
+    "good morning",
+    "how are you doing",
+    "hey",
+    "hello there",
+    "slay",
+    "what's the weather like",
+    "lol",
+    "ok cool",
+]
+
+def in_list(text, keywords):
+    return any(x in text.lower() for x in keywords)
+
+#Copy of the routing chain from before IntentRouter (plus intents added since), returning the intent name instead of replying
+def legacy_route(text):
+    if in_list(text, ['upcoming event', 'upcoming chapter event', 'events coming up', 'future event', 'future chapter event']):
+        return 'upcoming_events'
+    elif in_list(text, ['update the events calendar', 'update events calendar', 'update calendar', 'update calendar of event', 'update event', 'update the event']):
+        return 'update_events'
+    elif 'slay' in text.lower():
+        return 'slay'
+    elif in_list(text, ['who is behind', "who's behind", 'report', 'summary', 'completion rate']) and in_list(text, ['requirement', 'credit']):
+        return 'requirements_report'
+    elif in_list(text, ['who has', "who's", 'report', 'summary', 'too many']) and in_list(text, ['absence', 'absent']):
+        return 'absences_report'
+    elif in_list(text, ['how many', 'which', 'what']) and in_list(text, ['requirements', 'credits']):
+        return 'requirements'
+    elif in_list(text, ['update the roster', 'update roster', 'update brother list', 'update brother roster']):
+        return 'update_roster'
+    elif in_list(text, ['chapter zoom', 'zoom link', 'zoom meeting']):
+        return 'zoom'
+    elif in_list(text, ['mailtime', 'mail time']):
+        return 'mailtime'
+    elif in_list(text, ['update the budget', 'update budget', 'update the chapter budget', 'update chapter budget']):
+        return 'update_budget'
+    elif in_list(text, ['budget', 'budget spreadsheet', 'budget sheet', 'budget google sheet']):
+        return 'budget'
+    elif in_list(text, ['what', 'where', 'when']) and in_list(text, ["today's event", "todays event", "today's events", "todays events", "today's chapter event", "today's chapter event", "todays chapter event", "today"]):
+        return 'todays_event'
+    elif in_list(text, ['how many', 'which', 'what']) and in_list(text, ['ritual', 'tradition']):
+        return 'ritual_attendance'
+    elif in_list(text, ['how many', 'which', 'what']) and in_list(text, ['chapter meeting', 'meeting', 'chapter event', 'event']) and any(x in text.lower() for x in ['missed', 'attended', 'gone to', 'shown up', 'showed up']):
+        return 'chapter_attendance'
+    elif in_list(text, ['thank', 'thanks', 'thx', 'ty']):
+        return 'thanks'
+    elif profanity.contains_profanity(text.lower()):
+        return 'profanity'
+    elif 'joke' in text.lower():
+        return 'joke'
+    elif in_list(text, ['random fact', 'a fact', 'fact']):
+        return 'fact'
+    elif in_list(text, ['bye', 'goodbye', 'cya', 'see ya', 'see you', 'later', 'adios', 'farewell']):
+        return 'bye'
+    elif in_list(text, ['goodnight', 'gn', 'night', 'good night']):
+        return 'goodnight'
+    elif in_list(text, ['good morning', 'gm', 'morning', 'goodmorning']):
+        return 'good_morning'
+    elif in_list(text, ['how are you', 'how are u', 'how r u', 'how you doin', 'how u doin']):
+        return 'how_are_you'
+    elif in_list(text, ['hi', 'hello', 'howdy', 'hola', 'hey']):
+        return 'hello'
+    return None
+
+#Random messages built from intent keywords mixed with filler words
+def synthetic_messages(count, seed=0):
+    rng = random.Random(seed)
+    keywords = [keyword for _, groups, _ in INTENTS for group in groups for keyword in group]
+    filler = ['the', 'please', 'can', 'you', 'tell', 'me', 'about', 'our', 'next', 'week', 'so', 'far', 'bro', 'quick', 'question']
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(filler) for _ in range(rng.randint(2, 12))]
+        for _ in range(rng.randint(0, 3)):
+            words.insert(rng.randint(0, len(words)), rng.choice(keywords))
+        message = ' '.join(words)
+        messages.append(message.capitalize() if rng.random() < 0.5 else message)
+    return messages
+
+def per_message(route, corpus, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for text in corpus:
+            route(text)
+        elapsed = (time.perf_counter() - started) / len(corpus)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--synthetic', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    router = IntentRouter()
+    corpus = MESSAGES + synthetic_messages(args.synthetic)
+    mismatches = [text for text in corpus if router.route(text) != legacy_route(text)]
+    if mismatches:
+        raise SystemExit(f"Router disagrees with the old chain on {len(mismatches)} messages, e.g. {mismatches[:3]}")
+
+    before = per_message(legacy_route, corpus, args.rounds)
+    after = per_message(router.route, corpus, args.rounds)
+    print(f"{len(corpus)} messages, same intent for every one")
+    print(f"if/elif chain: {before * 1e6:7.2f} us per message")
+    print(f"IntentRouter:  {after * 1e6:7.2f} us per message ({before / after:.1f}x)")
+
+if __name__ == "__main__":
+    main()
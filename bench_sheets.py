@@ -0,0 +1,55 @@
+import argparse
+import random
+import time
+
+from fakes import FakeSheetsClient
+from sheets import batch_get_values, get_values_concurrently, get_values_serially
+
+#Compare the serial, concurrent and batched ways of loading requirement worksheets, offline
+#Usage: python bench_sheets.py --latency 0.15 --categories 4 --members 80
+
+CATEGORIES = ['Service', 'Professional', 'Fundraising', 'Rush', 'Social', 'Philanthropy', 'Brotherhood', 'Alumni']
+
+def requirement_sheet(members, events):
+    headers = ['Name', 'Completed (2)'] + [f"Event {i}" for i in range(events)]
+    rows = [headers]
+    for i in range(members):
+        done = [random.choice(['TRUE', 'FALSE']) for _ in range(events)]
+        rows.append([f"Member{i} L", str(done.count('TRUE'))] + done)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.15, help='seconds per simulated Sheets request')
+    parser.add_argument('--categories', type=int, default=4)
+    parser.add_argument('--members', type=int, default=80)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    client = FakeSheetsClient(latency=args.latency)
+    titles = [f"{name} Requirements" for name in (CATEGORIES * 4)[:args.categories]]
+    titles = [f"{title} {i}" if titles.count(title) > 1 else title for i, title in enumerate(titles)]
+    spreadsheet = client.add_spreadsheet('roster', {title: requirement_sheet(args.members, args.events) for title in titles})
+    worksheets = [spreadsheet._worksheets[i] for i in range(len(titles))]
+
+    strategies = [
+        ('serial', lambda: get_values_serially(worksheets)),
+        ('concurrent', lambda: get_values_concurrently(worksheets)),
+        ('batched', lambda: batch_get_values(spreadsheet, titles)),
+    ]
+    expected = get_values_serially(worksheets)
+    print(f"{len(titles)} worksheets x {args.members} members, {args.latency * 1000:.0f} ms per request")
+    for name, run in strategies:
+        timings = []
+        client.reset_calls()
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            values = run()
+            timings.append(time.perf_counter() - started)
+            assert values == expected, f"{name} returned different values"
+        calls = client.total_calls() / args.repeat
+        print(f"{name:>10}: {min(timings) * 1000:8.1f} ms best, {sum(timings) / len(timings) * 1000:8.1f} ms avg, {calls:.0f} requests")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+#Measure how long a fresh worker takes to import bot.py and answer its first request, offline
+#Each run is a new Python process in a scratch directory, with Slack & Google left unconfigured so nothing can hit the network
+#Usage: python bench_startup.py --runs 5
+
+HEAVY_MODULES = ['pandas', 'numpy', 'gspread', 'dadjokes', 'randfacts', 'better_profanity', 'apscheduler', 'requests']
+
+CHILD = r'''
+import hashlib, hmac, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import bot
+imported = time.perf_counter()
+
+body = json.dumps({'type': 'url_verification', 'challenge': 'ready'})
+timestamp = str(int(time.time()))
+signature = 'v0=' + hmac.new(b'bench', f'v0:{timestamp}:{body}'.encode(), hashlib.sha256).hexdigest()
+response = bot.app.test_client().post('/slack/events', data=body, content_type='application/json',
+                                      headers={'X-Slack-Request-Timestamp': timestamp, 'X-Slack-Signature': signature})
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+
+print(json.dumps({
+    'import': imported - started,
+    'first_request': served - imported,
+    'loaded': [name for name in sys.argv[2:] if name in sys.modules],
+}))
+'''
+
+def run_once(project):
+    scratch = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        env = dict(os.environ, SLACK_SIGNING_SECRET='bench', SLACK_BOT_TOKEN='xoxb-bench', SLACK_BOT_USER_ID='UBENCH', BOT_SCHEDULER='off')
+        output = subprocess.run([sys.executable, '-c', CHILD, project] + HEAVY_MODULES, cwd=scratch, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    project = os.path.dirname(os.path.abspath(__file__))
+    runs = [run_once(project) for _ in range(args.runs)]
+    for key in ('import', 'first_request'):
+        timings = [run[key] for run in runs]
+        print(f"{key:14} median {statistics.median(timings) * 1000:7.1f} ms  max {max(timings) * 1000:7.1f} ms")
+    loaded = sorted(set().union(*(run['loaded'] for run in runs)))
+    print(f"heavy modules loaded at startup: {', '.join(loaded) or 'none'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import calendar
+import logging
+import os
+import time
+from datetime import date, timedelta
+from itertools import takewhile
+
+from builds import RosterBuilds
+from dates import MONTHS
+
+logger = logging.getLogger(__name__)
+
+#"October 18th" / "Oct 18" / "October 18, 2002" -> "10-18" (None if the cell isn't a date)
+def birthday_key(text):
+    parts = (text or '').replace(',', ' ').split()
+    if len(parts) < 2:
+        return None
+    month = MONTHS.get(parts[0].lower()) or MONTHS.get(parts[0][:3].lower())
+    digits = ''.join(takewhile(str.isdigit, parts[1]))
+    if not month or not digits:
+        return None
+    try:
+        #2000 was a leap year, so Feb 29 is accepted
+        date(2000, month, int(digits))
+    except ValueError:
+        return None
+    return f"{month:02d}-{int(digits):02d}"
+
+#Index keys celebrated on a day (Feb 29 birthdays are celebrated on Feb 28 in other years)
+def keys_for(day):
+    keys = [day.strftime('%m-%d')]
+    if day.month == 2 and day.day == 28 and not calendar.isleap(day.year):
+        keys.append('02-29')
+    return keys
+
+#Birthday (month-day) -> Slack user IDs, rebuilt only when the roster or the Slack directory changes
+class BirthdayIndex:
+    def __init__(self, connect, key, load_members, find_user):
+        #connect() -> sqlite3 connection, key(url) -> what a build depends on (roster revision & directory version, None if unknown),
+        #load_members(url) -> [(first name, last name, birthday cell)], find_user(name) -> Slack user ID or None
+        self.connect = connect
+        self.load_members = load_members
+        self.find_user = find_user
+        self.builds = RosterBuilds(connect, 'birthdays', key, self.build, self._save, self._load)
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS birthday_index (roster_url TEXT, month_day TEXT, user_id TEXT, PRIMARY KEY (roster_url, month_day, user_id))''')
+        conn.commit()
+        conn.close()
+
+    #Slack user IDs whose birthday is on the given day
+    def users_on(self, roster_url, day):
+        index = self.builds.get(roster_url)
+        return sorted({user_id for key in keys_for(day) for user_id in index.get(key, ())})
+
+    def _save(self, c, roster_url, index):
+        c.execute('''DELETE FROM birthday_index WHERE roster_url = ?''', (roster_url,))
+        c.executemany('''INSERT OR IGNORE INTO birthday_index (roster_url, month_day, user_id) VALUES (?, ?, ?)''',
+                      [(roster_url, key, user_id) for key, user_ids in index.items() for user_id in user_ids])
+
+    def _load(self, c, roster_url):
+        index = {}
+        for month_day, user_id in c.execute('''SELECT month_day, user_id FROM birthday_index WHERE roster_url = ?''', (roster_url,)):
+            index.setdefault(month_day, []).append(user_id)
+        return index
+
+    def build(self, roster_url):
+        index = {}
+        unmatched = []
+        for first, last, cell in self.load_members(roster_url):
+            key = birthday_key(cell)
+            if key is None:
+                continue
+            name = f"{first.strip().lower()} {last.strip().lower()}"
+            user_id = self.find_user(name)
+            #Skip people we can't find instead of giving up on everyone after them
+            if user_id is None:
+                unmatched.append(name)
+                continue
+            index.setdefault(key, []).append(user_id)
+        if unmatched:
+            logger.warning("No Slack user for %d birthday(s) on the roster: %s", len(unmatched), ', '.join(unmatched))
+        return index
+
+    #Forget every build for a roster (e.g. when the roster link changes)
+    def invalidate(self, roster_url=None):
+        self.builds.invalidate(roster_url)
+
+    def stats(self):
+        return {url: {'key': key, 'people': sum(len(user_ids) for user_ids in index.values())} for url, (key, index) in self.builds.loaded().items()}
+
+#Which birthday DMs have gone out, shared by every worker through SQLite
+#A worker claims a (day, user) before sending; a claim that is never marked sent expires after `lease` seconds,
+#so a crashed or failed delivery is picked up by the next run without anyone getting the message twice
+class BirthdayDeliveries:
+    def __init__(self, connect, lease=None):
+        self.connect = connect
+        self.lease = lease if lease is not None else float(os.getenv('BIRTHDAY_LEASE_SECONDS', 600))
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS birthday_deliveries (day TEXT, user_id TEXT, status TEXT, claimed_at REAL, PRIMARY KEY (day, user_id))''')
+        conn.commit()
+        conn.close()
+
+    #Return True if this worker should send the user's message for the day
+    def claim(self, day, user_id):
+        now = time.time()
+        conn = self.connect()
+        c = conn.cursor()
+        c.execute('''INSERT INTO birthday_deliveries (day, user_id, status, claimed_at) VALUES (?, ?, 'sending', ?)
+                     ON CONFLICT(day, user_id) DO UPDATE SET status = 'sending', claimed_at = excluded.claimed_at
+                     WHERE birthday_deliveries.status = 'failed' OR (birthday_deliveries.status = 'sending' AND birthday_deliveries.claimed_at < ?)''',
+                  (day, user_id, now, now - self.lease))
+        claimed = c.rowcount == 1
+        conn.commit()
+        conn.close()
+        return claimed
+
+    def _mark(self, day, user_id, status):
+        conn = self.connect()
+        conn.execute('''UPDATE birthday_deliveries SET status = ? WHERE day = ? AND user_id = ?''', (status, day, user_id))
+        conn.commit()
+        conn.close()
+
+    def sent(self, day, user_id):
+        self._mark(day, user_id, 'sent')
+
+    #Let the next run try again
+    def failed(self, day, user_id):
+        self._mark(day, user_id, 'failed')
+
+    #Drop records older than `days` days
+    def purge(self, days=7):
+        conn = self.connect()
+        conn.execute('''DELETE FROM birthday_deliveries WHERE day < ?''', ((date.today() - timedelta(days=days)).isoformat(),))
+        conn.commit()
+        conn.close()
+
+    def stats(self, day=None):
+        conn = self.connect()
+        rows = conn.execute('''SELECT status, COUNT(*) FROM birthday_deliveries WHERE day = ? GROUP BY status''', ((day or date.today()).isoformat(),)).fetchall()
+        conn.close()
+        return dict(rows)
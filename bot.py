@@ -1,155 +1,459 @@
 import os
+import json
 from slack_sdk.signature import SignatureVerifier
-from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from dotenv import load_dotenv
 from pathlib import Path
 from slackeventsapi import SlackEventAdapter
-from flask import Flask, request, Response
-import gspread
-import numpy as np
-import pandas as pd
-from datetime import datetime
-import re
+from flask import Flask, request, Response, abort, jsonify
+from datetime import date, datetime
 import sqlite3
-from dadjokes import Dadjoke
-from apscheduler.schedulers.background import BackgroundScheduler
-from better_profanity import profanity
-import randfacts
+import atexit
+import fcntl
+import time
+from functools import wraps
+from urllib.parse import urlparse
+from worker import WorkerPool
+from outbox import PooledWebClient, SlackOutbox
+from cache import SheetCache, SingleFlight
+from mirror import SheetMirror
+from directory import UserDirectory
+from identity import IdentityIndex
+from router import IntentRouter
+from dedup import MessageDeduplicator
+from links import LinkConfig
+from lazy import Lazy
+from tracing import Tracer, request_logger
+from birthdays import BirthdayIndex, BirthdayDeliveries
+from content import ContentPool
+from tenants import TenantRegistry
+from fanout import FanOut
+from responses import ResponseCache
+from pages import Reply, PageStore, MORE_ACTION, without_button
 
 #Load the token from .env & authenticate access to the Slack bot app
 env_path = Path('.') / '.env'
 load_dotenv(dotenv_path=env_path)
 
-#Authenticate access to the Google Sheet
-sa = gspread.service_account(filename='service_account.json')
+#Heavy libraries (gspread, pandas, numpy, dadjokes, randfacts, apscheduler) are imported where they are first used,
+#and nothing below talks to Google or Slack until a request or scheduled job needs it, so workers boot quickly
+
+#Spans, API call counts & latency histograms for every request, served on /metrics, plus one JSON log line per request
+tracer = Tracer(logger=request_logger())
+
+#Name a Sheets/Drive API call after its endpoint, without the spreadsheet ID (e.g. values.batchGet)
+def sheets_method(method, endpoint):
+    path = urlparse(endpoint).path
+    if path.startswith('/drive/'):
+        return f"drive.files.{method.lower()}"
+    action = path.rsplit(':', 1)[1] if ':' in path.rsplit('/', 1)[-1] else method.lower()
+    return f"{'values' if '/values' in path else 'spreadsheets'}.{action}"
+
+#Authenticate access to the Google Sheet (on first use)
+def open_sheets_client():
+    import gspread
+    sheets_client = gspread.service_account(filename='service_account.json')
+
+    #Every Sheets & Drive call goes through Client.request, so time them all there (and charge them to the chapter's budget)
+    request = sheets_client.request
+    def traced_request(method, endpoint, *args, **kwargs):
+        tenant().sheets_budget.acquire()
+        with tracer.external('sheets', sheets_method(method, endpoint)):
+            return request(method, endpoint, *args, **kwargs)
+    sheets_client.request = traced_request
+    return sheets_client
+
+sa = Lazy(open_sheets_client)
+
+#Return the spreadsheet's Drive modifiedTime, used to tell whether the mirror is still current
+def sheet_revision(url):
+    from gspread.utils import extract_id_from_url
+    return sa.get()._get_file_drive_metadata(extract_id_from_url(url)).get('modifiedTime')
 
 def open_connection():
     connection = sqlite3.connect("database.db")
     return connection
 
-#Initialize the Slack client
-client = WebClient(token=os.getenv('SLACK_BOT_TOKEN'))
-BOT_ID = client.api_call("auth.test")['user_id']
+#Independent Google & Slack calls within a request (or job) are made at the same time
+fanout = FanOut()
+atexit.register(fanout.shutdown)
+
+#Drop the in-memory copies of worksheets the mirror just rewrote
+def mirror_changed(url, titles):
+    for chapter in tenants.loaded():
+        chapter.sheet_cache.invalidate(url)
+
+#Queries read the roster & events calendar from a local SQLite mirror that a background job keeps in sync
+sheet_mirror = SheetMirror(open_connection, lambda url: sa.get().open_by_url(url), sheet_revision, mirror_changed, fanout)
+
+#Return the list of worksheets in a spreadsheet (cached)
+def worksheet_list(url):
+    return worksheets_values(url, [None], lambda missing: {None: sheet_mirror.worksheets(url)})[None]
+
+#Return all values of a worksheet (cached); callers must not modify the returned lists
+def worksheet_values(url, title):
+    return worksheets_values(url, [title])[title]
+
+#Return {title: values} for several worksheets, reading the uncached ones from the mirror in one query
+def worksheets_values(url, titles, load=None):
+    load = load or (lambda missing: sheet_mirror.values_many(url, missing))
+    misses = []
+    def traced_load(missing):
+        misses.extend(missing)
+        with tracer.span('mirror_read'):
+            return load(missing)
+    values = tenant().sheet_cache.get_many(url, titles, traced_load)
+    tracer.cache(hits=len(titles) - len(misses), misses=len(misses))
+    return values
+
+#Bring the chapter's spreadsheets in the mirror up to date with Google Sheets (run by the scheduler); they are synced at the same time
+def sync_mirror():
+    urls = [url for url in (tenant().links.get('roster_url'), tenant().links.get('events_url')) if url]
+    #Failures are already logged; queries keep using the last good copy
+    fanout.gather(*[lambda url=url: sheet_mirror.sync(url) for url in urls], return_exceptions=True)
+    #Match the new roster to Slack users (and tell the admins about names that don't match) right away
+    if tenant().links.get('roster_url'):
+        identity_index.refresh(tenant().links.get('roster_url'))
+
+#Tell the user how fresh the mirrored data behind an answer is
+def data_as_of(url):
+    synced_at = sheet_mirror.synced_at(url)
+    if synced_at is None:
+        return ""
+    return f"\n_Data as of {synced_at.strftime('%b %-d, %-I:%M %p')}_"
+
+#Initialize a chapter's Slack client
+def open_slack_client(chapter):
+    slack_client = PooledWebClient(token=chapter.bot_token)
+
+    #Every Web API method goes through api_call, so time them all there (and charge them to the chapter's budget)
+    api_call = slack_client.api_call
+    def traced_api_call(api_method, *args, **kwargs):
+        chapter.slack_budget.acquire()
+        with tracer.external('slack', api_method):
+            return api_call(api_method, *args, **kwargs)
+    slack_client.api_call = traced_api_call
+    return slack_client
+
+#Give a chapter its own Slack client, outbox, user directory, links & worksheet cache (called the first time the chapter is seen)
+def setup_tenant(chapter):
+    chapter.client = open_slack_client(chapter)
+    #The bot's own user ID in the chapter's workspace (set SLACK_BOT_USER_ID / --bot-user-id to skip the auth.test call)
+    chapter.bot_id = Lazy(lambda: chapter.bot_user_id or chapter.client.api_call("auth.test")['user_id'])
+    #Outgoing messages go through per-channel queues that respect Slack's rate limits (a 429 only pauses this chapter)
+    chapter.outbox = SlackOutbox(chapter.client)
+    atexit.register(chapter.outbox.shutdown)
+    #Local copy of the Slack user list so queries don't call users.info
+    chapter.user_directory = UserDirectory(chapter.client)
+    #Mirror reads cached in memory by (spreadsheet url, worksheet title), in a partition capped at the chapter's quota
+    #so a big chapter only ever evicts its own worksheets; the mirrored revision is a one-row SQLite read, so it is checked on
+    #every access and a worker that didn't run the sync stops serving the old values as soon as the mirror has new ones
+    chapter.sheet_cache = SheetCache(max_bytes=chapter.cache_bytes, revision=sheet_mirror.mirrored_revision, check_interval=0)
+    #The links row, served from memory
+    chapter.links = LinkConfig(open_connection, on_change=link_changed, team_id=chapter.team_id)
+
+#The chapters (Slack teams) this deployment serves; see tenants.py for adding one
+tenants = TenantRegistry(open_connection, setup_tenant)
+
+#The chapter the current request or job is for
+def tenant():
+    return tenants.current()
+
+#Roster revision as seen by the current chapter's cache (the mirrored revision)
+def roster_revision(url):
+    return tenant().sheet_cache.revision_of(url)
 
 #Define SQLite database
 conn = open_connection()
 c = conn.cursor()
 
 #Create a links table that will store the links to the Google Sheet
-c.execute('''CREATE TABLE IF NOT EXISTS links (id INTEGER PRIMARY KEY AUTOINCREMENT, events_url TEXT, roster_url TEXT, budget_url TEXT)''')
+c.execute('''CREATE TABLE IF NOT EXISTS links (id INTEGER PRIMARY KEY AUTOINCREMENT, events_url TEXT, roster_url TEXT, budget_url TEXT, team_id TEXT)''')
 conn.commit()
 conn.close()
 
+#Return the values of every worksheet in the roster
+def roster_values(roster_url):
+    return worksheets_values(roster_url, [worksheet.title for worksheet in worksheet_list(roster_url)])
+
+#Tell the admins about roster names that can't be matched to exactly one Slack user
+def report_identity_problems(report):
+    text = "Heads up: I couldn't match some people on the roster to Slack users :slightly_frowning_face:\n"
+    for user_id, titles in report['ambiguous'].items():
+        text += f"- <@{user_id}> matches more than one row on: {', '.join(titles)}\n"
+    for name in report['unmatched']:
+        text += f"- No Slack user matches roster name *{name}*\n"
+    for user_id in admin_ids():
+        send_dm_message(user_id, text)
+
+#What the identity & birthday indexes are built from: the roster revision & the chapter's Slack directory,
+#so people who join or change their name on Slack are matched without waiting for a roster edit
+def roster_build_key(url):
+    revision = roster_revision(url)
+    if revision is None:
+        return None
+    return f"{revision}:{tenant().user_directory.version()}"
+
+#Slack user ID -> roster row, rebuilt whenever the roster or the directory changes
+identity_index = IdentityIndex(open_connection, roster_build_key, roster_values, lambda: tenant().user_directory.users(), report_identity_problems)
+
+#First name, last name & birthday of everyone on the roster's active members worksheet
+def active_members(roster_url):
+    worksheets = worksheet_list(roster_url)
+    title = next((worksheet.title for worksheet in worksheets if any(x in worksheet.title.lower() for x in ['active brother', 'active member'])), None)
+    if title is None:
+        return []
+    return [(row[0], row[1], row[4]) for row in worksheet_values(roster_url, title)[1:] if len(row) > 4]
+
+#Birthday -> Slack user IDs, rebuilt whenever the roster or the directory changes, & a shared record of the birthday DMs already sent
+birthday_index = BirthdayIndex(open_connection, roster_build_key, active_members, lambda name: tenant().user_directory.find_by_name(name))
+birthday_deliveries = BirthdayDeliveries(open_connection)
+
+#Per-user answers rendered from the roster, reused until the mirrored roster or the Slack directory changes
+#(the same key the identity index is built for, so an answer never outlives the name -> row match it was rendered with);
+#renders read the chapter's worksheet cache & identity index, which revalidate against that key
+response_cache = ResponseCache(open_connection, roster_build_key)
+
+#Drop everything cached for a link when it is replaced (here or in another worker)
+def link_changed(column, old_link, new_link):
+    for link in (old_link, new_link):
+        if link:
+            for chapter in tenants.loaded():
+                chapter.sheet_cache.invalidate(link)
+            identity_index.invalidate(link)
+            birthday_index.invalidate(link)
+            response_cache.invalidate(link)
+
 #Initialize the Flask app & Slack event adapter
 app = Flask(__name__)
 slack_events_adapter = SlackEventAdapter(os.getenv('SLACK_SIGNING_SECRET'), "/slack/events", app)
 
-processed_messages = set()
+#Messages already handled by any worker (bounded in memory, shared through database.db)
+processed_messages = MessageDeduplicator(open_connection)
+
+#Keep the user directory current as people join or edit their profiles
+@slack_events_adapter.on("user_change")
+@slack_events_adapter.on("team_join")
+def user_updated(payload):
+    chapter = tenants.get(payload.get("team_id"))
+    user = payload.get("event", {}).get("user")
+    if chapter is not None and isinstance(user, dict):
+        chapter.user_directory.update_user(user)
+
+#Jokes & facts are fetched ahead of time in the background, so those intents never wait on the network
+def fetch_joke():
+    from dadjokes import Dadjoke
+    with tracer.external('dadjokes', 'joke'):
+        return Dadjoke().joke
+
+def fetch_fact():
+    import randfacts
+    return randfacts.get_fact()
+
+#The pools are filled when the scheduler starts; until then (or if the sources are down) these are served instead
+jokes = ContentPool(open_connection, 'joke', fetch_joke, "I'm fresh out of jokes right now. Ask me again in a minute :sweat_smile:")
+facts = ContentPool(open_connection, 'fact', fetch_fact, "I'm fresh out of facts right now. Ask me again in a minute :sweat_smile:")
+
+#Compile the intent keywords once at startup
+intent_router = IntentRouter()
+
+#Intents run on a bounded background pool so the Slack event is acknowledged immediately
+work_queue = WorkerPool()
+atexit.register(work_queue.shutdown)
 
 @slack_events_adapter.on("message")
 def message(payload):
+    started = time.perf_counter()
+    try:
+        acknowledge(payload)
+    finally:
+        tracer.metrics.observe('bot_event_ack_seconds', 'Time to acknowledge a Slack message event', time.perf_counter() - started)
+
+def acknowledge(payload):
     #Extract all the necessary information from the payload
     event = payload.get("event", {})
     channel_id = event.get("channel")
     user_id = event.get("user")
     text = event.get("text")
-    message_id = event.get("ts")
+    team_id = payload.get("team_id") or event.get("team")
+    message_id = f"{team_id}:{channel_id}:{event.get('ts')}" if team_id else f"{channel_id}:{event.get('ts')}"
+
+    #A retry because we were too slow to answer is one we already got, so drop it before doing any work;
+    #other retries (our 503 below, or a delivery that never reached us) go on to the dedup claim
+    if request.headers.get('X-Slack-Retry-Num') and request.headers.get('X-Slack-Retry-Reason') == 'http_timeout':
+        return
+
+    #Only answer messages people send: edits (including our own chat.update of a placeholder or page), deletions & other
+    #subtypes come without a user or text
+    if event.get("subtype") or not user_id or not text:
+        return
+
+    #Only answer chapters this deployment serves
+    chapter = tenants.get(team_id)
+    if chapter is None:
+        return
     
     #Ignore messages from the bot itself
-    if BOT_ID != user_id:
+    if chapter.bot_id.get() != user_id:
 
         #Check if the message has already been processed
-        if message_id in processed_messages:
+        if not processed_messages.claim(message_id):
             return
-        processed_messages.add(message_id)
-
-        #Check if the message contains all possible keywords for 'upcoming events' in the user request
-        if in_list(text, ['upcoming event', 'upcoming chapter event', 'events coming up', 'future event', 'future chapter event']):
-            #Let the user know the bot is working on the request
-            send_chat_message(channel=channel_id, text="Give me a few seconds to fetch the data...")
-            send_chat_message(channel=channel_id, text=upcoming_events())
-        elif in_list(text, ['update the events calendar', 'update events calendar', 'update calendar', 'update calendar of event', 'update event', 'update the event']):
-            if 'Harsha' in client.users_info(user=user_id)['user']['profile']['real_name']:
-                db_logic("events_url", text)
-                send_chat_message(channel=channel_id, text="Updated the events calendar link for you :slightly_smiling_face:\nAll user queries will now use this updated link!")
-            else:
-                send_chat_message(channel=channel_id, text="Sorry, you don't have permission to update the events calendar :slightly_frowning_face:")
-        elif 'slay' in text.lower(): #and 'Hira' in client.users_info(user=user_id)['user']['profile']['real_name']:
-            send_chat_message(channel=channel_id, text="AUR NAURRR SLAYYY :fire::fire::fire:")
-        elif in_list(text, ['how many', 'which', 'what']) and in_list(text, ['requirements', 'credits']):
-            if in_list(text, ['have', 'need', 'completed', 'done']):
-                #Let the user know the bot is working on the request
-                send_chat_message(channel=channel_id, text="Give me a few seconds to fetch the data...")
-                send_chat_message(channel=channel_id, text=needed_requirements(user_id))
-        elif in_list(text, ['update the roster', 'update roster', 'update brother list', 'update brother roster']):
-            if 'Harsha' in client.users_info(user=user_id)['user']['profile']['real_name']:
-                db_logic("roster_url", text)
-                send_chat_message(channel=channel_id, text="Updated the roster link for you :slightly_smiling_face:\nAll user queries will now use this updated link!")
-            else:
-                send_chat_message(channel=channel_id, text="Sorry, you don't have permission to update the roster :slightly_frowning_face:")
-        elif in_list(text, ['chapter zoom', 'zoom link', 'zoom meeting']):
-            send_chat_message(channel=channel_id, text=f"Here's the link to the chapter Zoom:\n\n {chapter_zoom()}")
-        elif in_list(text, ['mailtime', 'mail time']):
-            send_chat_message(channel=channel_id, text=f"Here's the link to the mailtime form: https://bit.ly/mailtimeforms")
-        elif in_list(text, ['update the budget', 'update budget', 'update the chapter budget', 'update chapter budget']):
-            if 'Harsha' in client.users_info(user=user_id)['user']['profile']['real_name']:
-                db_logic("budget_url", text)
-                send_chat_message(channel=channel_id, text="Updated the budget link for you :slightly_smiling_face:\nAll user queries will now use this updated link!")
-            else:
-                send_chat_message(channel=channel_id, text="Sorry, you don't have permission to update the events calendar :slightly_frowning_face:")
-        elif in_list(text, ['budget', 'budget spreadsheet', 'budget sheet', 'budget google sheet']):
-            send_chat_message(channel=channel_id, text=f"{budget_sheet()}")
-        elif in_list(text, ['what', 'where', 'when']) and in_list(text, ["today's event", "todays event", "today's events", "todays events", "today's chapter event", "today's chapter event", "todays chapter event", "today"]):
-            send_chat_message(channel=channel_id, text=todays_event())
-        elif in_list(text, ['how many', 'which', 'what']) and in_list(text, ['ritual', 'tradition']):
-            #Let the user know the bot is working on the request
-            send_chat_message(channel=channel_id, text="Give me a few seconds to fetch the data...")
-            send_chat_message(channel=channel_id, text=ritual_attendance(user_id))
-        elif in_list(text, ['how many', 'which', 'what']) and in_list(text, ['chapter meeting', 'meeting', 'chapter event', 'event']) and any(x in text.lower() for x in ['missed', 'attended', 'gone to', 'shown up', 'showed up']):
-            #Let the user know the bot is working on the request
-            send_chat_message(channel=channel_id, text="Give me a few seconds to fetch the data...")
-            send_chat_message(channel=channel_id, text=chapter_attendance(user_id))
-        elif in_list(text, ['thank', 'thanks', 'thx', 'ty']):
-            #Send a reply saying you're welcome, with the user's name
-            send_chat_message(channel=channel_id, text="You're welcome!! <@%s> :smile:" % user_id)
-        elif profanity.contains_profanity(text.lower()):
-            send_chat_message(channel=channel_id, text="Please refrain from using that language. I'm only trying to help :face_with_symbols_on_mouth:")
-        elif 'joke' in text.lower():
-            dadjoke = Dadjoke()
-            send_chat_message(channel=channel_id, text=dadjoke.joke)
-        #Tell me a story functionality
-        elif in_list(text, ['random fact', 'a fact', 'fact']):
-            send_chat_message(channel=channel_id, text=randfacts.get_fact())
-        elif in_list(text, ['bye', 'goodbye', 'cya', 'see ya', 'see you', 'later', 'adios', 'farewell']):
-            #Send a reply saying goodbye, with the user's name
-            send_chat_message(channel=channel_id, text="Goodbye!! <@%s> :wave:" % user_id)
-        elif in_list(text, ['goodnight', 'gn', 'night', 'good night']):
-            #Send a reply saying goodnight, with the user's name
-            send_chat_message(channel=channel_id, text="Goodnight!! <@%s> :sleeping::crescent_moon:" % user_id)
-        elif in_list(text, ['good morning', 'gm', 'morning', 'goodmorning']):
-            #Send a reply saying good morning, with the user's name
-            send_chat_message(channel=channel_id, text="Good morning!! <@%s> :sunrise:" % user_id)
-        elif in_list(text, ['how are you', 'how are u', 'how r u', 'how you doin', 'how u doin']):
-            #Send a reply saying you're doing well, with the user's name
-            send_chat_message(channel=channel_id, text="I'm doing well, thanks for asking!! <@%s> :smile:" % user_id)
-        elif in_list(text, ['hi', 'hello', 'howdy', 'hola', 'hey']):
-            #Send a reply saying hello, with the user's name
-            send_chat_message(channel=channel_id, text="Hello!! <@%s> :wave: How can I help?" % user_id)
+
+        #Hand the intent to the worker pool (queued by chapter, so one chapter's burst can't hold up the others);
+        #if the queue or the chapter's share of it is full, ask Slack to retry later
+        if not work_queue.submit_as(chapter.team_id, traced_message, time.perf_counter(), chapter, channel_id, user_id, text):
+            processed_messages.release(message_id)
+            abort(Response("Bot is busy, please retry", 503, {'Retry-After': '5'}))
+
+#Handle a message for a chapter as one traced request (called from the worker pool)
+def traced_message(queued, chapter, channel_id, user_id, text):
+    with tenants.use(chapter), tracer.request('message', team=chapter.team_id, queue_ms=round((time.perf_counter() - queued) * 1000, 2)):
+        handle_message(channel_id, user_id, text)
+
+#Run the matching intent for a message
+def handle_message(channel_id, user_id, text):
+    #Find the intent in one pass over the text (see router.INTENTS for the keywords & precedence)
+    with tracer.span('route'):
+        intent = intent_router.route(text)
+    tracer.tag(intent=intent or 'unknown')
+
+    #Check if the message contains all possible keywords for 'upcoming events' in the user request
+    if intent == 'upcoming_events':
+        send_slow_answer(channel_id, upcoming_events)
+    elif intent == 'update_events':
+        if is_admin(user_id):
+            db_logic("events_url", text)
+            send_chat_message(channel=channel_id, text="Updated the events calendar link for you :slightly_smiling_face:\nAll user queries will now use this updated link!")
+        else:
+            send_chat_message(channel=channel_id, text="Sorry, you don't have permission to update the events calendar :slightly_frowning_face:")
+    elif intent == 'slay':
+        send_chat_message(channel=channel_id, text="AUR NAURRR SLAYYY :fire::fire::fire:")
+    elif intent == 'requirements_report':
+        if is_admin(user_id):
+            send_chat_message(channel=channel_id, text=requirements_report())
+        else:
+            send_chat_message(channel=channel_id, text="Sorry, only officers can see the chapter's requirement report :slightly_frowning_face:")
+    elif intent == 'absences_report':
+        if is_admin(user_id):
+            send_chat_message(channel=channel_id, text=absences_report())
+        else:
+            send_chat_message(channel=channel_id, text="Sorry, only officers can see the chapter's absence report :slightly_frowning_face:")
+    elif intent == 'requirements':
+        if in_list(text, ['have', 'need', 'completed', 'done']):
+            send_slow_answer(channel_id, lambda: needed_requirements(user_id))
+    elif intent == 'update_roster':
+        if is_admin(user_id):
+            db_logic("roster_url", text)
+            send_chat_message(channel=channel_id, text="Updated the roster link for you :slightly_smiling_face:\nAll user queries will now use this updated link!")
         else:
-            send_chat_message(channel=channel_id, text="Sorry, I don't understand that command :slightly_frowning_face:")
+            send_chat_message(channel=channel_id, text="Sorry, you don't have permission to update the roster :slightly_frowning_face:")
+    elif intent == 'zoom':
+        send_chat_message(channel=channel_id, text=f"Here's the link to the chapter Zoom:\n\n {chapter_zoom()}")
+    elif intent == 'mailtime':
+        send_chat_message(channel=channel_id, text=f"Here's the link to the mailtime form: https://bit.ly/mailtimeforms")
+    elif intent == 'update_budget':
+        if is_admin(user_id):
+            db_logic("budget_url", text)
+            send_chat_message(channel=channel_id, text="Updated the budget link for you :slightly_smiling_face:\nAll user queries will now use this updated link!")
+        else:
+            send_chat_message(channel=channel_id, text="Sorry, you don't have permission to update the events calendar :slightly_frowning_face:")
+    elif intent == 'budget':
+        send_chat_message(channel=channel_id, text=f"{budget_sheet()}")
+    elif intent == 'todays_event':
+        send_chat_message(channel=channel_id, text=todays_event())
+    elif intent == 'ritual_attendance':
+        send_slow_answer(channel_id, lambda: ritual_attendance(user_id))
+    elif intent == 'chapter_attendance':
+        send_slow_answer(channel_id, lambda: chapter_attendance(user_id))
+    elif intent == 'thanks':
+        #Send a reply saying you're welcome, with the user's name
+        send_chat_message(channel=channel_id, text="You're welcome!! <@%s> :smile:" % user_id)
+    elif intent == 'profanity':
+        send_chat_message(channel=channel_id, text="Please refrain from using that language. I'm only trying to help :face_with_symbols_on_mouth:")
+    elif intent == 'joke':
+        send_chat_message(channel=channel_id, text=jokes.take())
+    #Tell me a story functionality
+    elif intent == 'fact':
+        send_chat_message(channel=channel_id, text=facts.take())
+    elif intent == 'bye':
+        #Send a reply saying goodbye, with the user's name
+        send_chat_message(channel=channel_id, text="Goodbye!! <@%s> :wave:" % user_id)
+    elif intent == 'goodnight':
+        #Send a reply saying goodnight, with the user's name
+        send_chat_message(channel=channel_id, text="Goodnight!! <@%s> :sleeping::crescent_moon:" % user_id)
+    elif intent == 'good_morning':
+        #Send a reply saying good morning, with the user's name
+        send_chat_message(channel=channel_id, text="Good morning!! <@%s> :sunrise:" % user_id)
+    elif intent == 'how_are_you':
+        #Send a reply saying you're doing well, with the user's name
+        send_chat_message(channel=channel_id, text="I'm doing well, thanks for asking!! <@%s> :smile:" % user_id)
+    elif intent == 'hello':
+        #Send a reply saying hello, with the user's name
+        send_chat_message(channel=channel_id, text="Hello!! <@%s> :wave: How can I help?" % user_id)
+    else:
+        send_chat_message(channel=channel_id, text="Sorry, I don't understand that command :slightly_frowning_face:")
 
 #Define the function when the user types /help
 @app.route('/help', methods=['POST'])
 def help():
     data = request.form
     channel_id = data.get('channel_id')
-    send_chat_message(channel=channel_id, text='Here\'s the link to the user documentation: https://docs.google.com/document/d/11AJg75hrNBqvMluzdIpBV0ZRmww6LCLqcMITz1c6KFA/edit?usp=sharing')
+    chapter = tenants.get(data.get('team_id'))
+    if chapter is None:
+        return Response(), 200
+    with tenants.use(chapter):
+        send_chat_message(channel=channel_id, text='Here\'s the link to the user documentation: https://docs.google.com/document/d/11AJg75hrNBqvMluzdIpBV0ZRmww6LCLqcMITz1c6KFA/edit?usp=sharing')
     return Response(), 200
 
+#Per-chapter caches, outboxes & API budgets
+def tenant_stats(chapter):
+    return {'sheets_cache': chapter.sheet_cache.stats(), 'user_directory': chapter.user_directory.stats(), 'outbox': chapter.outbox.stats(),
+            'sheets_budget': chapter.sheets_budget.stats(), 'slack_budget': chapter.slack_budget.stats()}
+
+#Expose the worker pool's queue depth & wait times
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({'worker_pool': work_queue.stats(), 'tenants': {chapter.team_id or 'default': tenant_stats(chapter) for chapter in tenants.loaded()}, 'identity_index': identity_index.stats(), 'dedup': processed_messages.stats(), 'mirror': sheet_mirror.stats(), 'parsing': parse_flights.stats(), 'birthdays': {'index': birthday_index.stats(), 'today': birthday_deliveries.stats()}, 'content': {'jokes': jokes.stats(), 'facts': facts.stats()}, 'fanout': fanout.stats(), 'responses': response_cache.stats(), 'pages': reply_pages.stats()})
+
+#Prometheus-style metrics: request & stage latencies by intent, external API calls, cache hits & queue depths
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(tracer.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+tracer.metrics.gauge('bot_worker_queue_depth', 'Intents waiting for a worker thread', lambda: work_queue.stats()['queue_depth'])
+tracer.metrics.gauge('bot_outbox_queued', 'Slack messages waiting to be sent, by chapter',
+                     lambda: {(('team', chapter.team_id or 'default'),): chapter.outbox.stats()['queued'] for chapter in tenants.loaded()})
+tracer.metrics.gauge('bot_sheets_cache_bytes', 'Estimated size of the worksheet cache, by chapter',
+                     lambda: {(('team', chapter.team_id or 'default'),): chapter.sheet_cache.stats()['bytes'] for chapter in tenants.loaded()})
+
+#Decorator: serve a user's answer (as a Reply) from the response cache while the roster is unchanged
+#The "Data as of" line is added on every reply, so it stays current even when the answer itself is reused
+def cached_response(intent):
+    def decorate(render):
+        @wraps(render)
+        def answer(user_id):
+            roster_url = tenant().links.get('roster_url')
+            #Someone new to this worker's copy of the directory changes its version, so look them up before the key is read
+            tenant().user_directory.get(user_id)
+            rendered = []
+            def render_now():
+                rendered.append(True)
+                response = render(user_id)
+                return (response if isinstance(response, Reply) else Reply(response)).to_json()
+            #Replies are cached as JSON; the suffix keeps answers cached as plain text by older versions out
+            response = Reply.from_json(response_cache.get(roster_url, f"{intent}:reply", user_id, render_now))
+            tracer.tag(response_cache='miss' if rendered else 'hit')
+            response.footer = f"{response.footer}{data_as_of(roster_url)}".lstrip('\n')
+            return response
+        return answer
+    return decorate
+
 #Define the function to return service requirements for all brothers
+@cached_response('requirements')
+@tracer.traced
 def needed_requirements(user_id):
-    #Grab the roster url from the database
+    #Grab the roster url from the link config
     roster = roster_ws()
     roster_url = roster[0]
     worksheets = roster[1]
@@ -160,94 +464,140 @@ def needed_requirements(user_id):
         if any(x in worksheet.title.lower() for x in ['service', 'professional', 'fundraising', 'rush']):
             indices.append(worksheets.index(worksheet))
 
-    response = ""
+    items = []
+
+    #Download every requirement worksheet in one round trip; roster_grid() then reads them from the cache
+    worksheets_values(roster_url, [worksheets[index].title for index in indices])
 
     #Iterate through all worksheets that contain the keywords
     for index in indices:
-        #Get the req_list
-        req_list = roster_df(roster_url, index, worksheets, user_id)[0]
-        headers = roster_df(roster_url, index, worksheets, user_id)[1]
+        #Get the requirement grid & the user's row in it
+        grid, row = roster_grid(roster_url, worksheets[index].title, user_id)
 
-        if req_list.empty:
+        if row is None:
             return "Sorry, I couldn't find your name in the roster :slightly_frowning_face:"
         
         #Get requirement as listed in the header
         try:
-            requirement = headers[1].split('(')[1].rstrip(')')
+            requirement = grid.headers[1].split('(')[1].rstrip(')')
         except:
             requirement = "N/A"
-            
-        response += f"*{worksheets[index].title.split()[0]} requirements needed:* {requirement}\n"
 
-        #If the user has not completed the requirements, return a string saying so
-        if req_list.iloc[0,1] == 0:
-            response += f"\nYou have *NOT* completed any {worksheets[index].title.split()[0]} requirement(s) for this semester yet!"
+        category = worksheets[index].title.split()[0]
+        items.append(f"*{category} requirements needed:* {requirement}")
+
+        #If the user has not completed the requirements, say so
+        if grid.counts[row] in ('', '0'):
+            items.append(f"You have *NOT* completed any {category} requirement(s) for this semester yet!")
         else:
-            response += f"\nYou have completed *{req_list.iloc[0, 1]} {worksheets[index].title.split()[0].lower()} requirement(s)* for this semester! Here are the {worksheets[index].title.split()[0].lower()} events you have completed:\n"
-            for col in req_list.columns[2:]:
-                if req_list.iloc[0, req_list.columns.get_loc(col)] == 'TRUE':
-                    response += f"- {col}\n"
-            response += "\n\n"
-    response += "*Disclaimer:* \n- The requirements are assuming you are an active brother. If you are PT LOA, please reach out to the VPO to confirm your requirements.\n"
-    response += "- If you are missing any requirements that you have already fulfilled, please reach out to the VPO. There may be discrepancies because I pull data from the roster, which may not be up-to-date yet :slightly_smiling_face:"
+            items.append(f"You have completed *{grid.counts[row]} {category.lower()} requirement(s)* for this semester! Here are the {category.lower()} events you have completed:")
+            items += [f"- {col}" for col in grid.checked(row)]
+        items.append("")
+    footer = "*Disclaimer:* \n- The requirements are assuming you are an active brother. If you are PT LOA, please reach out to the VPO to confirm your requirements.\n"
+    footer += "- If you are missing any requirements that you have already fulfilled, please reach out to the VPO. There may be discrepancies because I pull data from the roster, which may not be up-to-date yet :slightly_smiling_face:"
+    return Reply(items=items, footer=footer)
+
+#Absences at which someone shows up on the officers' absence report
+CHAPTER_ABSENCE_LIMIT = int(os.getenv('CHAPTER_ABSENCE_LIMIT', 3))
+RITUAL_ABSENCE_LIMIT = int(os.getenv('RITUAL_ABSENCE_LIMIT', 2))
+
+#Officer view of every requirement worksheet: completion rate & who is behind, computed over the whole roster at once
+@tracer.traced
+def requirements_report():
+    from aggregates import requirement_summary
+
+    roster_url, worksheets = roster_ws()
+    titles = [worksheet.title for worksheet in worksheets if any(x in worksheet.title.lower() for x in ['service', 'professional', 'fundraising', 'rush'])]
+    if not titles:
+        return "Sorry, I couldn't find any requirement sheets on the roster :slightly_frowning_face:"
+
+    worksheets_values(roster_url, titles)
+    response = "Here's where the chapter stands on requirements:\n\n"
+    for title in titles:
+        summary = requirement_summary(attendance_grid(roster_url, title))
+        category = title.split()[0]
+        if summary['required'] is None:
+            response += f"*{category}:* I couldn't tell how many are required from the sheet's header\n\n"
+            continue
+        response += f"*{category}* ({summary['required']:g} required): {summary['completed']}/{summary['members']} complete ({summary['completion_rate']:.0%})\n"
+        for name, count in summary['behind']:
+            response += f"- {name}: {count:g}\n"
+        response += "\n"
+    response += data_as_of(roster_url)
     return response
 
-#Define the function to return the upcoming events
-def upcoming_events():
-    #Grab the events url from the database
-    conn = open_connection()
-    c = conn.cursor()
-    events_url = c.execute('''SELECT events_url FROM links''').fetchone()[0]
-    conn.close()
-
-    #Extract the upcoming events from the Google Sheet
-    events_calendar = sa.open_by_url(events_url).worksheet("Semester Calendar")
-
-    #Grab all events from the Google Sheet and convert first 6 columns into a numpy array, ignoring the first 3 rows
-    events_list = np.array(events_calendar.get_all_values()[3:])[:,:6]
-
-    #Grab the first row of the Google Sheet as indices for the events list
-    indices = events_calendar.get_all_values()[0][:6]
+#Officer view of ritual & chapter attendance: who is at or over the absence limit & the least attended events
+@tracer.traced
+def absences_report():
+    from aggregates import absence_summary
+
+    roster_url, worksheets = roster_ws()
+    sheets = []
+    for keyword, limit in (('ritual', RITUAL_ABSENCE_LIMIT), ('chapter attendance', CHAPTER_ABSENCE_LIMIT)):
+        title = next((worksheet.title for worksheet in worksheets if keyword in worksheet.title.lower()), None)
+        if title is not None:
+            sheets.append((title, limit))
+    if not sheets:
+        return "Sorry, I couldn't find the attendance sheets on the roster :slightly_frowning_face:"
+
+    worksheets_values(roster_url, [title for title, _ in sheets])
+    response = "Here's the chapter's attendance so far:\n\n"
+    for title, limit in sheets:
+        summary = absence_summary(attendance_grid(roster_url, title), limit)
+        response += f"*{title}* (average {summary['average']:.1f} absences): {len(summary['over_limit'])} with {limit} or more\n"
+        for name, count in summary['over_limit']:
+            response += f"- {name}: {count:g}\n"
+        if summary['attendance_rates']:
+            response += "Least attended: " + ", ".join(f"{event} ({rate:.0%})" for event, rate in summary['attendance_rates'][:3]) + "\n"
+        response += "\n"
+    response += data_as_of(roster_url)
+    return response
 
-    #Convert the numpy array into a pandas DataFrame using events_list as the data and indices as the column names
-    events_list = pd.DataFrame(data=events_list, columns=indices)
+#Weekly DM to the officers with both reports
+@tracer.traced
+def officer_digest():
+    text = f"{requirements_report()}\n\n{absences_report()}"
+    for user_id in admin_ids():
+        send_dm_message(user_id, text)
 
-    # Drop all rows with empty cells across all columns
-    events_list.dropna(axis=0, how='all', inplace=True)
+#Concurrent requests needing the same parse wait on one another instead of each parsing
+parse_flights = SingleFlight()
 
-    #Convert the month from name to a zero-padded number
-    events_list['Month'] = events_list['Month'].apply(lambda x: datetime.strptime(x, '%B').strftime('%m') if x else '')
+@tracer.traced
+def events_calendar():
+    from events import EventCalendar
 
-    #Add the date & strip the last 2 characters & convert to a zero-padded number
-    events_list['Date'] = events_list['Date'].apply(lambda x: x[:-2].zfill(2))
+    #Grab the events url from the link config
+    events_url = tenant().links.get('events_url')
 
-    # Add the current year to the concatenated month & date columns in the form MM/DD/YYYY
-    events_list['Date'] = events_list['Month'] + '/' + events_list['Date'] + '/' + datetime.now().strftime("%Y")
+    #Extract the events from the Google Sheet
+    values = worksheet_values(events_url, "Semester Calendar")
 
-    current_date = datetime.now().strftime("%m/%d/%Y")
+    #Parsed once per download (and per day) & kept with the worksheet in the chapter's cache, so it is shared between intents & scheduled jobs
+    today = date.today()
+    return tenant().sheet_cache.derived(events_url, "Semester Calendar", values, 'calendar', today,
+                                        lambda: parse_flights.do(('calendar', events_url, id(values), today), lambda: EventCalendar(values, today)))
 
-    #Filter the events list to only include events that have not passed yet
-    events_list = events_list[events_list['Date'] >= current_date]
+#Define the function to return the upcoming events
+@tracer.traced
+def upcoming_events():
+    #Grab the events from today onwards
+    events_list = events_calendar().upcoming()
 
     if events_list.empty:
         return "According to the events calendar, there are no upcoming events."
 
-    #Reset indices from 0
-    events_list.reset_index(drop=True, inplace=True)
-
-    #Construct the response to the user only according to whether or not certain fields are empty
-    response = f"Here are the upcoming events, according to the events calendar:\n\n"
-    for index in events_list.index:
-        response += f"- {events_list.iloc[index, 3].strip()} on *{events_list.iloc[index, 1].strip()}*"
-        if events_list.iloc[index, 2] != '':
-            response += f" at *{events_list.iloc[index, 2].strip()}*"
-        if events_list.iloc[index, 4] != '':
-            if 'Zoom' in events_list.iloc[index, 4]:
-                response += " on "
-            else:
-                response += " at "
-        response += f"{events_list.iloc[index, 4].strip()}\n"
-    return response
+    import numpy as np
+
+    #Build every event's line in one pass over the columns, leaving out the time & place when they are empty
+    names = events_list.iloc[:, 3].str.strip()
+    times = events_list.iloc[:, 2]
+    places = events_list.iloc[:, 4]
+    lines = ("- " + names + " on *" + events_list['date'].dt.strftime('%m/%d/%Y') + "*"
+             + np.where(times != '', " at *" + times.str.strip() + "*", "")
+             + np.where(places == '', "", np.where(places.str.contains('Zoom'), " on ", " at "))
+             + places.str.strip())
+    return Reply("Here are the upcoming events, according to the events calendar:\n", lines.tolist(), data_as_of(tenant().links.get('events_url')).lstrip('\n'))
 
 #Return the chapter zoom link from pinned messages
 def chapter_zoom():
@@ -258,16 +608,14 @@ def chapter_zoom():
 
     return link
         
+@cached_response('ritual_attendance')
+@tracer.traced
 def ritual_attendance(user_id):
-    #Grab the roster url from the database
+    #Grab the roster url from the link config
     roster = roster_ws()
     roster_url = roster[0]
     worksheets = roster[1]
 
-    response = ""
-    attended = ""
-    missed = ""
-    
     index = None
     #Return the indices of all worksheets that contain the keywords
     for worksheet in worksheets:
@@ -278,29 +626,23 @@ def ritual_attendance(user_id):
     if index == None:
         return "Sorry, I couldn't find the ritual attendance sheet :slightly_frowning_face:"
     
-    req_list = roster_df(roster_url, index, worksheets, user_id)[0]
+    grid, row = roster_grid(roster_url, worksheets[index].title, user_id)
 
-    if req_list.empty:
+    if row is None:
         return f"Sorry, I couldn't find your name in the roster :slightly_frowning_face:"
     
-    response += f"Here's how many ritual absences you have this semester: *{req_list.iloc[0, 1]}*\n\n"
-    attended += "You have *attended* the following events:\n"
-    missed += "You have *missed* the following events:\n"
-    #Loop through each column in the dataframe and add the events that the user has completed to the response
-    for col in req_list.columns[2:]:
-        if req_list.iloc[0, req_list.columns.get_loc(col)] == 'TRUE':
-            attended += f"- {col}\n"
-        elif req_list.iloc[0, req_list.columns.get_loc(col)] == 'FALSE':
-            missed += f"- {col}\n"
-    
-    response += f"\n{attended}\n{missed}\n\n"
-    response += "*Disclaimer:* \n- If you are PT LOA, please reach out to the VPO to confirm your ritual attendance requirements.\n"
-    response += "- If a ritual you have attended is counted as an absence, please reach out to the VPO. There may be discrepancies because I pull data from the roster's ritual attendance sheet, which may not be up-to-date yet :slightly_smiling_face:"
+    #The events that the user has attended & missed
+    items = ["You have *attended* the following events:"] + [f"- {col}" for col in grid.checked(row)]
+    items += ["", "You have *missed* the following events:"] + [f"- {col}" for col in grid.unchecked(row)]
 
-    return response
+    footer = "*Disclaimer:* \n- If you are PT LOA, please reach out to the VPO to confirm your ritual attendance requirements.\n"
+    footer += "- If a ritual you have attended is counted as an absence, please reach out to the VPO. There may be discrepancies because I pull data from the roster's ritual attendance sheet, which may not be up-to-date yet :slightly_smiling_face:"
+    return Reply(f"Here's how many ritual absences you have this semester: *{grid.counts[row]}*\n", items, footer)
 
+@cached_response('chapter_attendance')
+@tracer.traced
 def chapter_attendance(user_id):
-    #Grab the roster url from the database
+    #Grab the roster url from the link config
     roster = roster_ws()
     roster_url = roster[0]
     worksheets = roster[1]
@@ -315,124 +657,53 @@ def chapter_attendance(user_id):
     if index == None:
         return "Sorry, I couldn't find the ritual attendance sheet :slightly_frowning_face:"
     
-    req_list = roster_df(roster_url, index, worksheets, user_id)[0]
+    grid, row = roster_grid(roster_url, worksheets[index].title, user_id)
 
-    if req_list.empty:
+    if row is None:
         return f"Sorry, I couldn't find your name in the roster :slightly_frowning_face:"
     
-    response = f"Here's how many absences you have this semester for required chapter meetings & events: *{req_list.iloc[0, 1]}*\n\n"
-    missed = "You have *missed* the following required meetings & events:\n"
-
-    #Loop through each column in the dataframe and add the events that the user has missed to the response
-    for col in req_list.columns[2:]:
-        if req_list.iloc[0, req_list.columns.get_loc(col)] == 'FALSE':
-            missed += f"- {col}"
-            #Check if the column header has a '/'
-            if '/' in col:
-                missed += " chapter meeting\n"
-            else:
-                missed += "\n"
-    
-    response += f"{missed}\n\n"
-    response += "*Disclaimer:* \n- If you are PT LOA, please reach out to the VPO to confirm your chapter attendance requirements.\n"
-    response += "- If a chapter meeting/event you have attended is counted as an absence, please reach out to the VPO. There may be discrepancies because I pull data from the roster's chapter attendance sheet, which may not be up-to-date yet :slightly_smiling_face:"
+    #The meetings & events the user has missed (column headers with a '/' are dates of chapter meetings)
+    items = ["You have *missed* the following required meetings & events:"]
+    items += [f"- {col} chapter meeting" if '/' in col else f"- {col}" for col in grid.unchecked(row)]
 
-    return response
+    footer = "*Disclaimer:* \n- If you are PT LOA, please reach out to the VPO to confirm your chapter attendance requirements.\n"
+    footer += "- If a chapter meeting/event you have attended is counted as an absence, please reach out to the VPO. There may be discrepancies because I pull data from the roster's chapter attendance sheet, which may not be up-to-date yet :slightly_smiling_face:"
+    return Reply(f"Here's how many absences you have this semester for required chapter meetings & events: *{grid.counts[row]}*\n", items, footer)
+
+#How many birthday DMs to hand to the outbox before waiting for them to go out
+BIRTHDAY_BATCH_SIZE = int(os.getenv('BIRTHDAY_BATCH_SIZE', 20))
 
 #Automatically send a user "Happy Birthday" based on the roster when the date hits
+#Safe to run again (or in several workers): people who already got today's message are skipped & failed sends are retried
+@tracer.traced
 def birthday():
-    #Grab the roster url from the database
-    roster = roster_ws()
-    roster_url = roster[0]
-    worksheets = roster[1]
-
-    index = None
-    #Return the index of the worksheet that contains all active brothers
-    for worksheet in worksheets:
-        if any(x in worksheet.title.lower() for x in ['active brother', 'active member']):
-            index = worksheets.index(worksheet)
-            break
-    
-    #Grab today's date
-    today = datetime.today().strftime('%b %-d')
-    #today = 'Sep 13'
-
-    #Open the worksheet
-    current_worksheet = sa.open_by_url(roster_url).worksheet(worksheets[index].title)
-    #Grab all brothers' names and requirements from the Google Sheet and convert all columns into a numpy array, ignoring the first row
-    brothers_list = np.array(current_worksheet.get_all_values()[1:])
-    headers = current_worksheet.get_all_values()[0]
-    headers = list(filter(lambda item: item != "", headers))
-    req_list = brothers_list[:,:len(headers)]
-
-    #Convert the numpy array into a pandas DataFrame using brothers_list as the data and headers as the column names
-    req_list = pd.DataFrame(data=req_list, columns=headers)
-    req_list = req_list.iloc[:, [0,1,4]]
-
-    #Format all birthdays to be the format of today
-    req_list.iloc[:, 2] = req_list.iloc[:, 2].apply(format_birthday)
-
-    #Grab all birthdays that match the current date
-    req_list = req_list[req_list.iloc[:, 2] == today]
-
-    #If the birthday is empty, return a string saying so
-    if req_list.empty == '':
-        return
-    else:
-        #Iterate through every row in the df
-        for index, row in req_list.iterrows():
-            user_id = None
-
-            #Make a string of the 1st & 2nd column combined
-            name = row[0].lower() + ' ' + row[1].lower()
-
-            #Get the user's user_id based on their name
-            user_list = client.users_list()['members']
-            for user in user_list:
-                if user['profile']['real_name_normalized'].lower() == name:
-                    user_id = user['id']
-                    break
-            #Check if the user_id is None
-            if user_id == None:
-                return
-            else:
-                #Send the user a message
-                send_dm_message(user_id, f"Happy Birthday, <@{user_id}>! :tada: :birthday:")
+    roster_url = tenant().links.get('roster_url')
+    today = date.today()
+    day = today.isoformat()
+    birthday_deliveries.purge()
+
+    user_ids = birthday_index.users_on(roster_url, today)
+    for start in range(0, len(user_ids), BIRTHDAY_BATCH_SIZE):
+        sending = []
+        for user_id in user_ids[start:start + BIRTHDAY_BATCH_SIZE]:
+            if not birthday_deliveries.claim(day, user_id):
+                continue
+            try:
+                sending.append((user_id, send_dm_message(user_id, f"Happy Birthday, <@{user_id}>! :tada: :birthday:")))
+            except Exception:
+                birthday_deliveries.failed(day, user_id)
+        for user_id, delivery in sending:
+            try:
+                delivery.result()
+                birthday_deliveries.sent(day, user_id)
+            except Exception:
+                birthday_deliveries.failed(day, user_id)
 
 #Tell the user when & where today's event is
+@tracer.traced
 def todays_event():
-    #Grab the events url from the database
-    conn = open_connection()
-    c = conn.cursor()
-    events_url = c.execute('''SELECT events_url FROM links''').fetchone()[0]
-    conn.close()
-
-    #Extract the upcoming events from the Google Sheet
-    events_calendar = sa.open_by_url(events_url).worksheet("Semester Calendar")
-
-    #Grab all events from the Google Sheet and convert first 6 columns into a numpy array, ignoring the first 2 rows
-    events_list = np.array(events_calendar.get_all_values()[2:])[:,:6]
-
-    #Grab the first row of the Google Sheet as indices for the events list
-    indices = events_calendar.get_all_values()[0][:6]
-
-    #Convert the numpy array into a pandas DataFrame using events_list as the data and indices as the column names
-    events_list = pd.DataFrame(data=events_list, columns=indices)
-
-    #Convert the month from name to a zero-padded number
-    events_list['Month'] = events_list['Month'].apply(lambda x: datetime.strptime(x, '%B').strftime('%m') if x else '')
-
-    #Add the date & strip the last 2 characters & convert to a zero-padded number
-    events_list['Date'] = events_list['Date'].apply(lambda x: x[:-2].zfill(2))
-
-    # Add the current year to the concatenated month & date columns in the form MM/DD/YYYY
-    events_list['Date'] = events_list['Month'] + '/' + events_list['Date']
-
-    #Add the current year to the date column
-    current_date = datetime.now().strftime("%m/%d")
-
     #Grab today's event
-    events_list = events_list[events_list.iloc[:, 1] == current_date]
+    events_list = events_calendar().on(date.today())
 
     response = ''
 
@@ -465,95 +736,133 @@ def todays_event():
         else:
             response += f"*Location:* {event_location}\n\n"
     
+    response += data_as_of(tenant().links.get('events_url'))
     return response
 
 def send_chat_message(channel, text):
-    client.chat_postMessage(channel=channel, text=text)
+    return tenant().outbox.post(channel, text)
 
 def send_dm_message(user_id, text):
-    response = client.conversations_open(users=[user_id])
-    channel_id = response["channel"]["id"]
-    client.chat_postMessage(channel=channel_id, text=text)
+    return tenant().outbox.post_dm(user_id, text)
+
+#Let the user know the bot is working on the request if the answer takes a while, then put the answer in its place
+#Long answers (a Reply) go out as Block Kit pages: the first one right away, the rest when the user clicks "more"
+def send_slow_answer(channel, answer):
+    outbox = tenant().outbox
+    placeholder = outbox.placeholder(channel, "Give me a few seconds to fetch the data...")
+    response = answer()
+    if not isinstance(response, Reply):
+        return outbox.replace(channel, placeholder, response)
+    with tracer.span('render_pages'):
+        blocks, text = reply_pages.save(response.pages())[0]
+    return outbox.replace(channel, placeholder, text, blocks=blocks)
+
+#Later pages of long answers, until someone asks for them
+reply_pages = PageStore(open_connection)
+
+#Slack signs button clicks the same way as events
+signature_verifier = SignatureVerifier(os.getenv('SLACK_SIGNING_SECRET'))
+
+#Button clicks on messages (the "more" button on a long answer)
+#Slack wants a response within 3 seconds, so the next page is sent from the worker pool
+@app.route('/slack/interactions', methods=['POST'])
+def interactions():
+    if not signature_verifier.is_valid_request(request.get_data(), request.headers):
+        abort(403)
+    payload = json.loads(request.form.get('payload', '{}'))
+    chapter = tenants.get(payload.get('team', {}).get('id'))
+    if chapter is None:
+        return Response(), 200
+    channel_id = payload.get('channel', {}).get('id')
+    message_ts = payload.get('container', {}).get('message_ts') or payload.get('message', {}).get('ts')
+    for action in payload.get('actions', []):
+        if action.get('action_id') != MORE_ACTION:
+            continue
+        reply_id, page = action['value'].rsplit(':', 1)
+        #A double click only sends the page once
+        click_id = f"{reply_id}:{page}"
+        if not processed_messages.claim(click_id):
+            continue
+        #If the queue is full, let the click be tried again (Slack shows the user that it failed)
+        if not work_queue.submit_as(chapter.team_id, traced_page, chapter, channel_id, message_ts, reply_id, int(page)):
+            processed_messages.release(click_id)
+            abort(Response("Bot is busy, please retry", 503, {'Retry-After': '5'}))
+    return Response(), 200
+
+#Send the next page of a long answer as one traced request (called from the worker pool)
+def traced_page(chapter, channel_id, message_ts, reply_id, page):
+    with tenants.use(chapter), tracer.request('more', team=chapter.team_id, intent='more'):
+        send_page(channel_id, message_ts, reply_id, page)
+
+def send_page(channel_id, message_ts, reply_id, page):
+    outbox = tenant().outbox
+    stored = reply_pages.get(reply_id, page)
+    if stored is None:
+        outbox.post(channel_id, "Sorry, that list has expired. Ask me again for the latest :slightly_smiling_face:")
+        return
+    #The clicked page keeps its contents but loses its button
+    clicked = reply_pages.get(reply_id, page - 1)
+    if clicked is not None and message_ts:
+        outbox.update(channel_id, message_ts, clicked[1], blocks=without_button(clicked[0]))
+    blocks, text = stored
+    outbox.post(channel_id, text, blocks=blocks)
+
+#Chapters list their admins by Slack user ID; the default chapter falls back to matching the admin's name if BOT_ADMIN_IDS isn't set,
+#while chapters added with tenants.py only have the admins listed there
+BOT_ADMIN_NAME = os.getenv('BOT_ADMIN_NAME', 'Harsha')
+
+#Only the chapter's bot admins can change the links the bot reads from
+def is_admin(user_id):
+    if tenant().admin_ids or tenant().team_id is not None:
+        return user_id in tenant().admin_ids
+    return BOT_ADMIN_NAME in tenant().user_directory.real_name(user_id)
+
+def admin_ids():
+    if tenant().admin_ids or tenant().team_id is not None:
+        return tenant().admin_ids
+    return [user_id for user_id, real_name in tenant().user_directory.users() if BOT_ADMIN_NAME in real_name]
 
 def in_list(text, keywords):
     return any(x in text.lower() for x in keywords)
 
 #Refactor events_url and roster_url insertion into database into a single function
 def db_logic(column_to_update, text):
-    conn = open_connection()
-    c = conn.cursor()
-
-    #Check if id = 1 exists in the links table
-    c.execute('''SELECT * FROM links WHERE id = 1''')
-    if c.fetchone() is None:
-        #Insert a new row into the links table
-        c.execute(f'''INSERT INTO links ({column_to_update}) VALUES ("{text.split(':')[1].replace('<', '').strip() + text.split(':')[2].replace('>', '').strip()}")''')
-        conn.commit()
-    else:
-        #Update the events calendar link in the database for the entry id = 1
-        c.execute(f'''UPDATE links SET {column_to_update} = "{text.split(':')[1].replace('<', '').strip() + text.split(':')[2].replace('>', '').strip()}" WHERE id = 1''')
-        conn.commit()
-    conn.close()
-
-#Refactor roster dataframe creation into a single function
-def roster_df(roster_url, index, worksheets, user_id):
-
-    #Open the worksheet
-    current_worksheet = sa.open_by_url(roster_url).worksheet(worksheets[index].title)
-    #Grab all brothers' names and requirements from the Google Sheet and convert all columns into a numpy array, ignoring the first row
-    brothers_list = np.array(current_worksheet.get_all_values()[1:])
-    headers = current_worksheet.get_all_values()[0]
-    headers = list(filter(lambda item: item != "", headers))
-    req_list = brothers_list[:,:len(headers)]
-
-    #Convert the numpy array into a pandas DataFrame using brothers_list as the data and headers as the column names
-    req_list = pd.DataFrame(data=req_list, columns=headers)
-
-    #Filter the req list according to the user's name (from user id)
-    first_name = client.users_info(user=user_id)['user']['profile']['real_name'].split()[0].strip()
-    req_list = req_list[req_list.iloc[:, 0].str.lower().str.contains(first_name.lower(), flags=re.IGNORECASE, regex=True)]
-
-    # If the worksheet name has 'chapter attendance' in it, return the dataframe with the last column dropped
-    if 'chapter attendance' in worksheets[index].title.lower():
-        req_list = req_list.iloc[:, :-1]
-    elif 'ritual' in worksheets[index].title.lower():
-        req_list = req_list.iloc[:, :-1]
-    
-    #If the dataframe has more than 1 entry:
-    if len(req_list) > 1:
-        #Filter the req list according to the first letter of the user's last name
-        last_name = client.users_info(user=user_id)['user']['profile']['real_name'].split()[1].strip()
-        req_list = req_list[req_list.iloc[:, 0].str.lower().str.contains(last_name[0].lower(), flags=re.IGNORECASE, regex=True)]
-    
-    return req_list, headers
+    link = text.split(':')[1].replace('<', '').strip() + text.split(':')[2].replace('>', '').strip()
+    tenant().links.set(column_to_update, link)
+
+#Parse each roster worksheet into a packed attendance grid once per download (kept with the worksheet in the chapter's cache)
+@tracer.traced
+def attendance_grid(roster_url, title):
+    from grids import AttendanceGrid
+
+    values = worksheet_values(roster_url, title)
+    #Chapter attendance & ritual sheets end with a column that isn't an event
+    drop_last = any(x in title.lower() for x in ['chapter attendance', 'ritual'])
+    return tenant().sheet_cache.derived(roster_url, title, values, 'grid', drop_last,
+                                        lambda: parse_flights.do(('grid', roster_url, title, id(values)), lambda: AttendanceGrid(values, drop_last)))
+
+#Return a worksheet's grid and the user's row in it (None if they aren't on it)
+#Someone missing from this worker's copy of the directory (they joined since it was loaded) is looked up first,
+#which changes the directory version so the identity index is rebuilt with them in it
+def roster_grid(roster_url, title, user_id):
+    tenant().user_directory.get(user_id)
+    return attendance_grid(roster_url, title), identity_index.row(roster_url, title, user_id)
 
 #Refactor accessing roster worksheets into a single function
+@tracer.traced
 def roster_ws():
-    #Grab the roster url from the database
-    conn = open_connection()
-    c = conn.cursor()
-    roster_url = c.execute('''SELECT roster_url FROM links''').fetchone()[0]
-    conn.close()
-    return roster_url, sa.open_by_url(roster_url).worksheets()
-
-#Format the birthday to be the format of today
-def format_birthday(date):
-    date = date.split()
-    if len(date) == 0 or len(date) == 1:
-        return ''
-    birthday = f"{date[0][0:3]}"
-    if len(date[1]) == 3:
-        birthday += f" {date[1][0]}"
-    else:
-        birthday += f" {date[1][0:2]}"
-    return birthday
+    #Grab the roster url from the link config
+    roster_url = tenant().links.get('roster_url')
+    #Finding the user's row needs the Slack directory too, so on a cold start download both at the same time
+    user_directory = tenant().user_directory
+    if not user_directory.loaded:
+        worksheets, _ = fanout.gather(lambda: worksheet_list(roster_url), user_directory.users)
+        return roster_url, worksheets
+    return roster_url, worksheet_list(roster_url)
 
 def budget_sheet():
-    #Grab the budget url from the database
-    conn = open_connection()
-    c = conn.cursor()
-    budget_url = c.execute('''SELECT budget_url FROM links''').fetchone()[0]
-    conn.close()
+    #Grab the budget url from the link config
+    budget_url = tenant().links.get('budget_url')
     if budget_url is None:
         return 'I don\'t have access to the budget sheet. Please check with the VPF.'
     else:
@@ -561,15 +870,102 @@ def budget_sheet():
         budget_url = 'https:' + budget_url[1]
         return f'Here\'s the link to the chapter budget: {budget_url}'
 
-# Create a background scheduler
-scheduler = BackgroundScheduler()
-
-# Define the scheduled tasks
-scheduler.add_job(birthday, trigger="cron", hour=9, minute=00)
-
-# Start the scheduler
-scheduler.start()
+#Run a scheduled job as one traced request
+def traced_job(func):
+    @wraps(func)
+    def run():
+        with tracer.request('job', job=func.__name__):
+            func()
+    return run
+
+#Run a scheduled job once for every chapter, each as its own traced request; one chapter failing doesn't stop the rest
+def tenant_job(func):
+    @wraps(func)
+    def run():
+        errors = []
+        for chapter in tenants.all():
+            try:
+                with tenants.use(chapter), tracer.request('job', job=func.__name__, team=chapter.team_id):
+                    func()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+    return run
+
+def refresh_user_directory():
+    tenant().user_directory.refresh()
+    #People who joined or were renamed are matched to the roster right away
+    if tenant().links.get('roster_url'):
+        identity_index.refresh(tenant().links.get('roster_url'))
+
+#The background scheduler, once this process has started it
+scheduler = None
+scheduler_lock_file = None
+#When this process last tried to take the scheduler lock; a process without it tries again at most every BOT_SCHEDULER_RETRY_SECONDS
+scheduler_attempted = None
+SCHEDULER_RETRY_SECONDS = float(os.getenv('BOT_SCHEDULER_RETRY_SECONDS', 60))
+
+#Run the scheduled jobs in exactly one process: the first one to take the lock file (BOT_SCHEDULER=on/off overrides this)
+def start_scheduler():
+    global scheduler, scheduler_lock_file, scheduler_attempted
+    if scheduler is not None:
+        return True
+    scheduler_attempted = time.monotonic()
+    mode = os.getenv('BOT_SCHEDULER', 'auto')
+    if mode == 'off':
+        return False
+    if mode != 'on':
+        lock_file = open(os.getenv('BOT_SCHEDULER_LOCK', 'scheduler.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            #Another worker runs the jobs
+            lock_file.close()
+            return False
+        #Held (and the lock with it) for as long as this process lives
+        scheduler_lock_file = lock_file
+
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    # Create a background scheduler
+    scheduler = BackgroundScheduler()
+
+    # Define the scheduled tasks
+    #Birthdays go out at 9am; the hourly reruns only retry messages that failed
+    scheduler.add_job(tenant_job(birthday), trigger="cron", hour="9-20", minute=00)
+    scheduler.add_job(tenant_job(officer_digest), trigger="cron", day_of_week=os.getenv('OFFICER_DIGEST_DAY', 'sun'), hour=18, minute=00)
+    scheduler.add_job(tenant_job(sync_mirror), trigger="interval", seconds=int(os.getenv('MIRROR_SYNC_SECONDS', 60)))
+    scheduler.add_job(traced_job(processed_messages.purge), trigger="interval", minutes=10)
+    scheduler.add_job(traced_job(response_cache.purge), trigger="interval", hours=1)
+    scheduler.add_job(traced_job(reply_pages.purge), trigger="interval", hours=6)
+    #Also run right away, so a new deployment has jokes & facts stored before anyone asks
+    scheduler.add_job(traced_job(jokes.refill), trigger="interval", minutes=int(os.getenv('CONTENT_POOL_REFILL_MINUTES', 30)), next_run_time=datetime.now())
+    scheduler.add_job(traced_job(facts.refill), trigger="interval", minutes=int(os.getenv('CONTENT_POOL_REFILL_MINUTES', 30)), next_run_time=datetime.now())
+    scheduler.add_job(tenant_job(refresh_user_directory), trigger="interval", minutes=int(os.getenv('USER_DIRECTORY_REFRESH_MINUTES', 60)))
+
+    # Start the scheduler
+    scheduler.start()
+    atexit.register(scheduler.shutdown, wait=False)
+    return True
+
+#Called in each gunicorn worker right after it forks (see gunicorn.conf.py)
+#Connections opened in the parent can't be shared, so drop them, then try to become the scheduler process
+def after_fork():
+    sa.reset()
+    for chapter in tenants.loaded():
+        chapter.client.reset_session()
+    fanout.reset()
+    start_scheduler()
+
+#Servers without the gunicorn hook start the scheduler on their first request instead
+#(workers that lost the race try again now & then, so another one takes over if the scheduler's worker exits)
+@app.before_request
+def ensure_scheduler():
+    if scheduler is None and (scheduler_attempted is None or time.monotonic() - scheduler_attempted >= SCHEDULER_RETRY_SECONDS):
+        start_scheduler()
 
 #Concurrently run the schedule and the flask app
 if __name__ == "__main__":
+    start_scheduler()
     app.run(debug=True)
\ No newline at end of file
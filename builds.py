@@ -0,0 +1,73 @@
+import threading
+from datetime import datetime
+
+#Something worked out from a roster (who is on which row, whose birthday is when), kept per roster url
+#and rebuilt only when its key changes (e.g. the roster revision & the Slack directory version)
+#Builds are stored in SQLite so every worker process can reuse them; the owner says how to build, save & load one
+class RosterBuilds:
+    def __init__(self, connect, name, key, build, save, load):
+        #connect() -> sqlite3 connection, name tells the owners' builds apart, key(url) -> what a build depends on (None if unknown),
+        #build(url) -> value, save(cursor, url, value) replaces the stored copy, load(cursor, url) -> value
+        self.connect = connect
+        self.name = name
+        self.key = key
+        self.build = build
+        self.save = save
+        self.load = load
+        self.builds = {}
+        self.lock = threading.Lock()
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS roster_builds (name TEXT, roster_url TEXT, key TEXT, built_at TEXT, PRIMARY KEY (name, roster_url))''')
+        conn.commit()
+        conn.close()
+
+    #The build for the roster's current key
+    def get(self, roster_url):
+        key = self.key(roster_url)
+        build = self.builds.get(roster_url)
+        #If the key can't be worked out, keep using what we have
+        if build is not None and (key is None or build[0] == key):
+            return build[1]
+        with self.lock:
+            build = self.builds.get(roster_url)
+            if build is not None and (key is None or build[0] == key):
+                return build[1]
+            value = self._load(roster_url, key)
+            if value is None:
+                value = self.build(roster_url)
+                self._store(roster_url, key, value)
+            self.builds[roster_url] = (key, value)
+            return value
+
+    #Reuse a build another worker already stored for this key
+    def _load(self, roster_url, key):
+        if key is None:
+            return None
+        conn = self.connect()
+        c = conn.cursor()
+        stored = c.execute('''SELECT key FROM roster_builds WHERE name = ? AND roster_url = ?''', (self.name, roster_url)).fetchone()
+        value = self.load(c, roster_url) if stored is not None and stored[0] == key else None
+        conn.close()
+        return value
+
+    def _store(self, roster_url, key, value):
+        conn = self.connect()
+        c = conn.cursor()
+        self.save(c, roster_url, value)
+        c.execute('''INSERT OR REPLACE INTO roster_builds (name, roster_url, key, built_at) VALUES (?, ?, ?, ?)''',
+                  (self.name, roster_url, key, datetime.now().isoformat()))
+        conn.commit()
+        conn.close()
+
+    #Forget every build for a roster (e.g. when the roster link changes)
+    def invalidate(self, roster_url=None):
+        with self.lock:
+            if roster_url is None:
+                self.builds.clear()
+            else:
+                self.builds.pop(roster_url, None)
+
+    #roster url -> (key, value) of the builds this process holds
+    def loaded(self):
+        return dict(self.builds)
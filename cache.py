@@ -0,0 +1,269 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+#Rough size of a cached value in bytes (worksheet values are lists of lists of strings)
+def estimate_size(value):
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+class CacheEntry:
+    __slots__ = ('value', 'size', 'expires', 'revision', 'derived')
+
+    def __init__(self, value, size, expires, revision):
+        self.value = value
+        self.size = size
+        self.expires = expires
+        self.revision = revision
+        #kind -> (key, object parsed from value)
+        self.derived = {}
+
+#One in-progress load that other callers can wait on
+class Flight:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+#Runs func() once for concurrent callers asking for the same key; the others wait and share its result
+class SingleFlight:
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.wait()
+        try:
+            flight.value = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.value
+
+    def stats(self):
+        with self.lock:
+            total = self.calls + self.coalesced
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'coalescing_ratio': self.coalesced / total if total else 0.0}
+
+#TTL + LRU cache for Google Sheets reads, keyed by (spreadsheet url, worksheet title)
+#When an entry expires, the spreadsheet's revision is checked first so unchanged sheets are not downloaded again
+#With a check_interval shorter than the TTL (e.g. 0 when the revision is a cheap local read), entries are also dropped
+#as soon as the revision moves on, instead of being served until they expire
+class SheetCache:
+    def __init__(self, ttl=None, max_bytes=None, revision=None, check_interval=None):
+        self.ttl = ttl if ttl is not None else float(os.getenv('SHEETS_CACHE_TTL', 300))
+        self.max_bytes = max_bytes or int(os.getenv('SHEETS_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+        #Callable taking a spreadsheet url and returning its current revision (or None to always reload)
+        self.revision = revision
+        #How long a revision that was read is trusted
+        self.check_interval = check_interval if check_interval is not None else self.ttl
+        self.entries = OrderedDict()
+        self.revisions = {}
+        self.flights = {}
+        self.bytes = 0
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    #Return the cached value for (url, title), calling loader() on a miss
+    def get(self, url, title, loader):
+        return self.get_many(url, [title], lambda missing: {title: loader()})[title]
+
+    #Return {title: value} for several worksheets of one spreadsheet, calling loader(missing_titles) once for every miss
+    def get_many(self, url, titles, loader):
+        result = {}
+        expired = []
+        now = time.monotonic()
+        #Revisions checked more often than entries expire: an unexpired entry from an older revision is stale too
+        current = self._current_revision(url) if self.check_interval < self.ttl else None
+        with self.lock:
+            for title in titles:
+                entry = self.entries.get((url, title))
+                if entry is not None and entry.expires > now and (current is None or current == entry.revision):
+                    self.entries.move_to_end((url, title))
+                    self.hits += 1
+                    result[title] = entry.value
+                else:
+                    expired.append((title, entry))
+        if not expired:
+            return result
+
+        #Expired: if the spreadsheet hasn't changed since we loaded it, keep the value for another TTL
+        revision = current if current is not None else self._current_revision(url)
+        missing = []
+        for title, entry in expired:
+            if entry is not None and revision is not None and revision == entry.revision:
+                with self.lock:
+                    entry.expires = now + self.ttl
+                    if (url, title) in self.entries:
+                        self.entries.move_to_end((url, title))
+                    self.hits += 1
+                    self.revalidated += 1
+                result[title] = entry.value
+            else:
+                missing.append(title)
+
+        if not missing:
+            return result
+
+        #Concurrent callers missing the same worksheet wait for whoever started loading it first
+        leading = []
+        waiting = []
+        with self.lock:
+            for title in missing:
+                flight = self.flights.get((url, title))
+                if flight is not None:
+                    waiting.append((title, flight))
+                    self.coalesced += 1
+                else:
+                    leading.append((title, Flight()))
+                    self.flights[(url, title)] = leading[-1][1]
+            self.misses += len(leading)
+
+        if leading:
+            try:
+                loaded = loader([title for title, _ in leading])
+                for title, flight in leading:
+                    self.put(url, title, loaded[title], revision)
+                    flight.value = result[title] = loaded[title]
+            except Exception as e:
+                for title, flight in leading:
+                    flight.error = e
+                raise
+            finally:
+                with self.lock:
+                    for title, flight in leading:
+                        del self.flights[(url, title)]
+                for title, flight in leading:
+                    flight.done.set()
+
+        for title, flight in waiting:
+            result[title] = flight.wait()
+        return result
+
+    def put(self, url, title, value, revision=None):
+        key = (url, title)
+        size = estimate_size(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            #Values bigger than the whole cache are returned but not stored
+            if size > self.max_bytes:
+                return
+            self.entries[key] = CacheEntry(value, size, time.monotonic() + self.ttl, revision)
+            self.bytes += size
+            self._evict()
+
+    #Return an object parsed from a cached worksheet (e.g. an events calendar), calling make() if there isn't one for `key` yet
+    #It is kept with the values it came from, so it counts against the same max_bytes (at the size of those values)
+    #and goes when they are evicted, invalidated or replaced; values that aren't cached (anymore) are parsed every time
+    def derived(self, url, title, values, kind, key, make):
+        with self.lock:
+            entry = self.entries.get((url, title))
+            if entry is None or entry.value is not values:
+                entry = None
+            elif kind in entry.derived and entry.derived[kind][0] == key:
+                return entry.derived[kind][1]
+        parsed = make()
+        if entry is None:
+            return parsed
+        extra = estimate_size(values) if kind not in entry.derived else 0
+        with self.lock:
+            if self.entries.get((url, title)) is entry:
+                if kind not in entry.derived:
+                    entry.size += extra
+                    self.bytes += extra
+                entry.derived[kind] = (key, parsed)
+                self._evict()
+        return parsed
+
+    #Drop the least recently used entries until the cache fits (call with the lock held)
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+
+    #Drop everything cached for a spreadsheet url, or the whole cache if no url is given
+    def invalidate(self, url=None):
+        with self.lock:
+            for key in [key for key in self.entries if url is None or key[0] == url]:
+                self.bytes -= self.entries.pop(key).size
+            if url is None:
+                self.revisions.clear()
+            else:
+                self.revisions.pop(url, None)
+
+    #Return the spreadsheet's current revision (checked at most once per check_interval), or None if it can't be told
+    def revision_of(self, url):
+        return self._current_revision(url)
+
+    #Revisions are checked at most once per check_interval per spreadsheet
+    def _current_revision(self, url):
+        if self.revision is None:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            cached = self.revisions.get(url)
+            if cached is not None and cached[1] > now:
+                return cached[0]
+        try:
+            revision = self.revision(url)
+        except Exception:
+            return None
+        with self.lock:
+            self.revisions[url] = (revision, now + self.check_interval)
+        return revision
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions,
+                #Misses that waited on another caller's load instead of loading themselves
+                'coalesced': self.coalesced,
+                'coalescing_ratio': self.coalesced / (self.misses + self.coalesced) if self.misses + self.coalesced else 0.0,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                #Every hit is a Sheets download that didn't happen
+                'api_calls_saved': self.hits,
+            }
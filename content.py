@@ -0,0 +1,143 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+#Jokes, facts & other filler content served from memory and topped up in the background
+#Unseen items are served first; once fewer than `low` are left a background thread fetches more until there are `high`.
+#Everything fetched is kept in SQLite, so a restart (or an upstream outage) falls back to repeating what we already have;
+#take() never waits on the network: with nothing stored at all it answers with `fallback` while a refill starts
+class ContentPool:
+    def __init__(self, connect, kind, fetch, fallback, low=None, high=None, keep=None):
+        #connect() -> sqlite3 connection, fetch() -> one new item (may be slow or fail), fallback -> what to serve when the pool is empty
+        self.connect = connect
+        self.kind = kind
+        self.fetch = fetch
+        self.fallback = fallback
+        self.low = low if low is not None else int(os.getenv('CONTENT_POOL_LOW', 5))
+        self.high = high if high is not None else int(os.getenv('CONTENT_POOL_HIGH', 25))
+        #How many items to keep in total
+        self.keep = keep if keep is not None else int(os.getenv('CONTENT_POOL_KEEP', 500))
+        self.fresh = deque()
+        self.served = []
+        #Items served since the last write to SQLite
+        self.consumed = []
+        self.loaded = False
+        self.refilling = False
+        self.lock = threading.Lock()
+
+        self.takes = 0
+        self.repeats = 0
+        self.fallbacks = 0
+        self.fetched = 0
+        self.fetch_failures = 0
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS content_pool (kind TEXT, text TEXT, served INTEGER DEFAULT 0, added REAL, PRIMARY KEY (kind, text))''')
+        conn.commit()
+        conn.close()
+
+    def _load(self):
+        conn = self.connect()
+        rows = conn.execute('''SELECT text, served FROM content_pool WHERE kind = ? ORDER BY added''', (self.kind,)).fetchall()
+        conn.close()
+        self.fresh = deque(text for text, served in rows if not served)
+        self.served = [text for text, served in rows if served]
+        self.loaded = True
+
+    #Return an item without touching the network
+    def take(self):
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            self.takes += 1
+            if self.fresh:
+                text = self.fresh.popleft()
+                self.served.append(text)
+                self.consumed.append(text)
+            elif self.served:
+                self.repeats += 1
+                text = random.choice(self.served)
+            else:
+                self.fallbacks += 1
+                text = self.fallback
+            low = len(self.fresh) < self.low
+        if low:
+            self.refill_async()
+        return text
+
+    def _start_refill(self):
+        with self.lock:
+            if self.refilling:
+                return False
+            self.refilling = True
+            return True
+
+    def refill_async(self):
+        if self._start_refill():
+            threading.Thread(target=self._refill, name=f"content-pool-{self.kind}", daemon=True).start()
+
+    #Fetch new items until there are `high` unseen ones (also run by the scheduler)
+    def refill(self):
+        if self._start_refill():
+            self._refill()
+
+    def _refill(self):
+        with self.lock:
+            #An empty pool may have been filled by another worker since it was loaded
+            if not self.loaded or not (self.fresh or self.served):
+                self._load()
+            wanted = self.high - len(self.fresh)
+            known = set(self.fresh) | set(self.served)
+        try:
+            items = []
+            #Upstream sources repeat themselves, so allow a few extra tries for duplicates
+            for _ in range(max(wanted, 0) * 2):
+                if len(items) >= wanted:
+                    break
+                try:
+                    text = self.fetch()
+                except Exception:
+                    self.fetch_failures += 1
+                    logger.warning("Couldn't fetch a %s; serving from the stored pool", self.kind, exc_info=True)
+                    break
+                if text and text not in known:
+                    known.add(text)
+                    items.append(text)
+            self.fetched += len(items)
+            self._save(items)
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    #Store new items & mark served ones, then trim the oldest served items past `keep`
+    def _save(self, items):
+        with self.lock:
+            consumed, self.consumed = self.consumed, []
+            self.fresh.extend(items)
+            self.served = self.served[-self.keep:]
+        now = time.time()
+        conn = self.connect()
+        c = conn.cursor()
+        c.executemany('''INSERT OR IGNORE INTO content_pool (kind, text, served, added) VALUES (?, ?, 0, ?)''', [(self.kind, text, now) for text in items])
+        c.executemany('''UPDATE content_pool SET served = served + 1 WHERE kind = ? AND text = ?''', [(self.kind, text) for text in consumed])
+        c.execute('''DELETE FROM content_pool WHERE kind = ? AND served > 0 AND text NOT IN
+                     (SELECT text FROM content_pool WHERE kind = ? ORDER BY added DESC LIMIT ?)''', (self.kind, self.kind, self.keep))
+        conn.commit()
+        conn.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'fresh': len(self.fresh),
+                'served': len(self.served),
+                'takes': self.takes,
+                'repeats': self.repeats,
+                'fallbacks': self.fallbacks,
+                'fetched': self.fetched,
+                'fetch_failures': self.fetch_failures,
+            }
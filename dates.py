@@ -0,0 +1,5 @@
+import calendar
+
+#Full and abbreviated month names -> month number
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
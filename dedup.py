@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+#Remembers which Slack messages have been handled, so retries and duplicate deliveries run only once
+#A bounded in-memory LRU answers repeats on the same worker; an expiring SQLite table (WAL mode) is shared by all workers
+class MessageDeduplicator:
+    def __init__(self, connect, ttl=None, max_entries=None):
+        #connect() -> sqlite3 connection to the shared database
+        self.connect = connect
+        self.ttl = ttl if ttl is not None else float(os.getenv('DEDUP_TTL', 3600))
+        self.max_entries = max_entries or int(os.getenv('DEDUP_MAX_ENTRIES', 10000))
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.claimed = 0
+        self.duplicates = 0
+
+        conn = self.connect()
+        conn.execute('''PRAGMA journal_mode=WAL''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS processed_messages (message_id TEXT PRIMARY KEY, expires REAL)''')
+        conn.commit()
+        conn.close()
+
+    #One connection per thread, reused between events
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            self.local.conn = conn
+        return conn
+
+    def _remember(self, message_id, now):
+        with self.lock:
+            self.seen[message_id] = now + self.ttl
+            self.seen.move_to_end(message_id)
+            while len(self.seen) > self.max_entries:
+                self.seen.popitem(last=False)
+
+    #Return True if this worker is the first to see the message (and should handle it)
+    def claim(self, message_id):
+        now = time.time()
+        with self.lock:
+            expires = self.seen.get(message_id)
+            if expires is not None and expires > now:
+                self.duplicates += 1
+                return False
+
+        #Insert the message, or take over a row that has expired; rowcount is 0 if another worker already has it
+        conn = self._connection()
+        cursor = conn.execute('''INSERT INTO processed_messages (message_id, expires) VALUES (?, ?)
+                                 ON CONFLICT (message_id) DO UPDATE SET expires = excluded.expires WHERE processed_messages.expires < ?''',
+                              (message_id, now + self.ttl, now))
+        conn.commit()
+        self._remember(message_id, now)
+        with self.lock:
+            if cursor.rowcount == 0:
+                self.duplicates += 1
+                return False
+            self.claimed += 1
+        return True
+
+    #Forget a claim so a redelivery gets handled (used when we couldn't take the work)
+    def release(self, message_id):
+        with self.lock:
+            self.seen.pop(message_id, None)
+        conn = self._connection()
+        conn.execute('''DELETE FROM processed_messages WHERE message_id = ?''', (message_id,))
+        conn.commit()
+
+    #Delete expired rows from the shared table
+    def purge(self):
+        conn = self._connection()
+        conn.execute('''DELETE FROM processed_messages WHERE expires < ?''', (time.time(),))
+        conn.commit()
+        now = time.time()
+        with self.lock:
+            for message_id in [message_id for message_id, expires in self.seen.items() if expires <= now]:
+                del self.seen[message_id]
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.seen), 'max_entries': self.max_entries, 'ttl_seconds': self.ttl, 'claimed': self.claimed, 'duplicates': self.duplicates}
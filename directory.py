@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+
+logger = logging.getLogger(__name__)
+
+#Lowercase a name and collapse its whitespace so "Harsha  K" and "harsha k" match
+def normalize_name(name):
+    return ' '.join((name or '').lower().split())
+
+#Local copy of the workspace's Slack users, indexed by user ID and by normalized real name
+#Loaded once with paging, refreshed in the background and patched by user_change/team_join events
+#Events only reach the worker that received them, so a copy older than max_age is also refreshed in the background on its next use
+class UserDirectory:
+    def __init__(self, client, page_size=None, max_age=None):
+        self.client = client
+        self.page_size = page_size or int(os.getenv('USER_DIRECTORY_PAGE_SIZE', 200))
+        self.max_age = max_age if max_age is not None else float(os.getenv('USER_DIRECTORY_MAX_AGE', 60 * 60))
+        self.by_id = {}
+        self.by_name = {}
+        self.loaded = False
+        self.refreshed = 0.0
+        self.refreshing = False
+        self.fingerprint = None
+        self.lock = threading.RLock()
+
+        self.lookups = 0
+        self.api_calls = 0
+
+    #Download every member with users.list, one page at a time
+    def refresh(self):
+        users = []
+        cursor = None
+        while True:
+            response = self.client.users_list(limit=self.page_size, cursor=cursor)
+            self.api_calls += 1
+            users.extend(response['members'])
+            cursor = response.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                break
+
+        by_id = {}
+        by_name = {}
+        for user in users:
+            self._index(user, by_id, by_name)
+        with self.lock:
+            self.by_id = by_id
+            self.by_name = by_name
+            self.fingerprint = None
+            self.loaded = True
+            self.refreshed = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            if time.monotonic() - self.refreshed > self.max_age:
+                self._refresh_in_background()
+            return
+        with self.lock:
+            if not self.loaded:
+                self.refresh()
+
+    #Keep answering from the current copy while a new one downloads
+    def _refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Refreshing the Slack user directory failed")
+                #Try again after another max_age instead of on every lookup
+                self.refreshed = time.monotonic()
+            finally:
+                self.refreshing = False
+        threading.Thread(target=run, name="user-directory-refresh", daemon=True).start()
+
+    def _index(self, user, by_id, by_name):
+        by_id[user['id']] = user
+        if user.get('deleted') or user.get('is_bot'):
+            return
+        profile = user.get('profile', {})
+        for name in (profile.get('real_name_normalized'), profile.get('real_name')):
+            if name:
+                by_name.setdefault(normalize_name(name), user['id'])
+
+    #Add or replace a single user (from a user_change or team_join event)
+    def update_user(self, user):
+        with self.lock:
+            old = self.by_id.get(user['id'])
+            if old is not None:
+                for name, user_id in list(self.by_name.items()):
+                    if user_id == user['id']:
+                        del self.by_name[name]
+            self._index(user, self.by_id, self.by_name)
+            self.fingerprint = None
+
+    def get(self, user_id):
+        self._ensure_loaded()
+        self.lookups += 1
+        user = self.by_id.get(user_id)
+        if user is None:
+            #Someone who joined after the last refresh
+            try:
+                user = self.client.users_info(user=user_id)['user']
+            except SlackApiError:
+                return None
+            self.api_calls += 1
+            self.update_user(user)
+        return user
+
+    def real_name(self, user_id):
+        user = self.get(user_id)
+        if user is None:
+            return ''
+        return user.get('profile', {}).get('real_name', '')
+
+    #Return the user ID whose real name matches, or None
+    def find_by_name(self, name):
+        self._ensure_loaded()
+        self.lookups += 1
+        return self.by_name.get(normalize_name(name))
+
+    #Return (user ID, real name) for every active human member
+    def users(self):
+        self._ensure_loaded()
+        with self.lock:
+            return [(user['id'], user.get('profile', {}).get('real_name', '')) for user in self.by_id.values()
+                    if not user.get('deleted') and not user.get('is_bot')]
+
+    #Changes whenever someone joins, leaves or changes their name, so anything matched against the directory knows to rebuild
+    #(it is a hash of the members, so workers with the same copy agree on it)
+    def version(self):
+        self._ensure_loaded()
+        with self.lock:
+            if self.fingerprint is None:
+                members = sorted((user['id'], user.get('profile', {}).get('real_name', ''), user.get('profile', {}).get('real_name_normalized', ''),
+                                  bool(user.get('deleted')), bool(user.get('is_bot'))) for user in self.by_id.values())
+                self.fingerprint = hashlib.sha1(repr(members).encode()).hexdigest()[:16]
+            return self.fingerprint
+
+    def stats(self):
+        return {
+            'users': len(self.by_id),
+            'names': len(self.by_name),
+            'lookups': self.lookups,
+            'api_calls': self.api_calls,
+        }
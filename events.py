@@ -0,0 +1,70 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from dates import MONTHS
+
+#The "Semester Calendar" worksheet parsed into events sorted by a typed date column
+#Rows are in calendar order, so the year goes up every time the month goes backwards (e.g. December -> January)
+class EventCalendar:
+    def __init__(self, values, today=None):
+        today = today or date.today()
+        self.today = today
+
+        #Grab the first 6 columns, using the first row as the column names & ignoring the first 2 rows
+        header = values[0][:6] if values else []
+        events = pd.DataFrame(data=[row[:6] for row in values[2:]], columns=header)
+
+        #Turn "September" / "Sep" into 9 and "22nd" into 22 for every row at once; rows without a date are dropped
+        if not events.empty and 'Month' in events and 'Date' in events:
+            month = events['Month'].str.strip().str.lower().map(MONTHS)
+            day = pd.to_numeric(events['Date'].str.strip().str[:-2], errors='coerce')
+            valid = (month.notna() & day.notna()).to_numpy()
+        else:
+            month = day = pd.Series(dtype=float)
+            valid = np.zeros(len(events), dtype=bool)
+        events = events[valid].reset_index(drop=True)
+        month = month[valid].to_numpy(dtype=np.int64)
+        day = day[valid].to_numpy(dtype=np.int64)
+
+        years = np.concatenate([[0], np.cumsum(np.diff(month) < 0)]).astype(np.int64) if len(month) else month
+        years = years + self._first_year(month, day, years, today)
+        dates = pd.to_datetime(pd.DataFrame({'year': years, 'month': month, 'day': day}), errors='coerce')
+
+        #Keep the events ordered by date so lookups are binary searches
+        events['date'] = dates
+        events = events[dates.notna().to_numpy()].sort_values('date', kind='stable').reset_index(drop=True)
+        self.events = events
+        self.dates = events['date'].to_numpy(dtype='datetime64[D]')
+
+    #Pick the starting year that puts the calendar closest to today (so a spring calendar read in December is next year's)
+    @staticmethod
+    def _first_year(month, day, years, today):
+        if not len(month):
+            return today.year
+        best = None
+        for first_year in (today.year, today.year - 1, today.year + 1):
+            try:
+                start = date(first_year + years[0], month[0], day[0])
+                end = date(first_year + years[-1], month[-1], day[-1])
+            except ValueError:
+                continue
+            distance = 0 if start <= today <= end else min(abs((today - start).days), abs((today - end).days))
+            if best is None or distance < best[0]:
+                best = (distance, first_year)
+        return best[1] if best else today.year
+
+    #Events between two dates (inclusive)
+    def between(self, start, end):
+        first = np.searchsorted(self.dates, np.datetime64(start, 'D'), side='left')
+        last = np.searchsorted(self.dates, np.datetime64(end, 'D'), side='right')
+        return self.events.iloc[first:last].reset_index(drop=True)
+
+    def on(self, day):
+        return self.between(day, day)
+
+    #Events from the given day (default today) onwards
+    def upcoming(self, day=None):
+        first = np.searchsorted(self.dates, np.datetime64(day or self.today, 'D'), side='left')
+        return self.events.iloc[first:].reset_index(drop=True)
@@ -0,0 +1,195 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import extract_id_from_url
+
+#Local stand-ins for the gspread client & the Slack Web API, used to benchmark the bot offline
+#Every request sleeps for `latency` seconds and is counted, like one round trip to the real API
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, values):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.values = values
+
+    def get_all_values(self):
+        self.spreadsheet.client.request('values.get')
+        return [list(row) for row in self.values]
+
+class FakeSpreadsheet:
+    def __init__(self, client, id, worksheets):
+        self.client = client
+        self.id = id
+        self._worksheets = [FakeWorksheet(self, title, values) for title, values in worksheets.items()]
+        self.modified_time = '1970-01-01T00:00:00.000Z'
+
+    def worksheets(self):
+        self.client.request('spreadsheets.get')
+        return list(self._worksheets)
+
+    def worksheet(self, title):
+        self.client.request('spreadsheets.get')
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise WorksheetNotFound(title)
+
+    def values_batch_get(self, ranges, params=None):
+        self.client.request('values.batchGet')
+        value_ranges = []
+        for range_name in ranges:
+            title = re.sub(r"^'(.*)'$", r'\1', range_name).replace("''", "'")
+            values = next(worksheet.values for worksheet in self._worksheets if worksheet.title == title)
+            #Like the real API, trailing empty cells are left out
+            trimmed = [list(row) for row in values]
+            for row in trimmed:
+                while row and row[-1] == '':
+                    row.pop()
+            value_ranges.append({'range': range_name, 'values': trimmed})
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+    #Replace a worksheet's values and bump the spreadsheet's revision
+    def update(self, title, values):
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                worksheet.values = values
+        self.modified_time = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()) + str(time.monotonic_ns())
+
+class FakeSheetsClient:
+    def __init__(self, latency=0.1, rate_limit=None):
+        self.latency = latency
+        #Maximum requests per second before the stand-in starts to queue callers (None = unlimited)
+        self.rate_limit = rate_limit
+        self.spreadsheets = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def add_spreadsheet(self, id, worksheets):
+        self.spreadsheets[id] = FakeSpreadsheet(self, id, worksheets)
+        return self.spreadsheets[id]
+
+    def request(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            delay = self.latency
+            if self.rate_limit:
+                now = time.monotonic()
+                self.next_slot = max(self.next_slot, now) + 1 / self.rate_limit
+                delay += self.next_slot - now - 1 / self.rate_limit
+        if delay > 0:
+            time.sleep(delay)
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+
+    def open_by_key(self, key):
+        self.request('spreadsheets.get')
+        return self.spreadsheets[key]
+
+    def open_by_url(self, url):
+        return self.open_by_key(extract_id_from_url(url))
+
+    def _get_file_drive_metadata(self, id):
+        self.request('drive.files.get')
+        return {'id': id, 'modifiedTime': self.spreadsheets[id].modified_time}
+
+#Answers the Slack Web API methods the bot uses over real HTTP on localhost, so the bot's own WebClient is exercised
+#Point a client at it with client.base_url = server.base_url
+class FakeSlackServer:
+    def __init__(self, users=(), latency=0.05, rate_limit=None):
+        #users: [(user_id, real_name)]
+        self.users = [{'id': user_id, 'name': real_name.lower().replace(' ', '.'), 'profile': {'real_name': real_name, 'real_name_normalized': real_name}}
+                      for user_id, real_name in users]
+        self.latency = latency
+        #Maximum calls per second for each method before answering 429 with Retry-After (None = unlimited)
+        self.rate_limit = rate_limit
+        self.calls = {}
+        self.rate_limited = 0
+        #(time.monotonic(), method, arguments) for every chat.postMessage & chat.update
+        self.messages = []
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.ts = 0
+
+        fake = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+                if 'json' in (self.headers.get('Content-Type') or ''):
+                    arguments = json.loads(body or '{}')
+                else:
+                    arguments = {key: values[0] for key, values in parse_qs(body).items()}
+                status, headers, response = fake.handle(self.path.rsplit('/', 1)[-1], arguments)
+                data = json.dumps(response).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/api/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, method, arguments):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if self.rate_limit:
+                second = int(time.monotonic())
+                window = self.windows.get(method)
+                count = window[1] + 1 if window and window[0] == second else 1
+                self.windows[method] = (second, count)
+                if count > self.rate_limit:
+                    self.rate_limited += 1
+                    return 429, {'Retry-After': '1'}, {'ok': False, 'error': 'ratelimited'}
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if method == 'auth.test':
+            return 200, {}, {'ok': True, 'user_id': 'UBOT'}
+        if method == 'users.list':
+            return 200, {}, {'ok': True, 'members': self.users, 'response_metadata': {'next_cursor': ''}}
+        if method == 'users.info':
+            user = next((user for user in self.users if user['id'] == arguments.get('user')), None)
+            return 200, {}, {'ok': True, 'user': user} if user else {'ok': False, 'error': 'user_not_found'}
+        if method == 'conversations.open':
+            return 200, {}, {'ok': True, 'channel': {'id': 'D' + str(arguments.get('users', '')).split(',')[0]}}
+        if method in ('chat.postMessage', 'chat.update'):
+            with self.lock:
+                self.ts += 1
+                ts = arguments.get('ts') or f"{self.ts}.000100"
+                self.messages.append((time.monotonic(), method, arguments))
+            return 200, {}, {'ok': True, 'channel': arguments.get('channel'), 'ts': ts}
+        return 200, {}, {'ok': False, 'error': 'unknown_method'}
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+            self.messages = []
+            self.rate_limited = 0
+
+    def shutdown(self):
+        self.server.shutdown()
@@ -0,0 +1,79 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+#Runs the independent external calls of one request at the same time, so the request waits for the slowest call instead of their sum
+#Calls run on a shared, bounded thread pool with the caller's context (so traces still see them);
+#a call made from inside a fanned-out call runs inline, so nested fan-outs can't use up the pool and deadlock
+class FanOut:
+    def __init__(self, workers=None):
+        self.workers = workers or int(os.getenv('FANOUT_WORKERS', 8))
+        self.pool = None
+        self.lock = threading.Lock()
+        self.inside = threading.local()
+
+        self.gathers = 0
+        self.calls = 0
+        self.inline = 0
+
+    def _pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fanout')
+            return self.pool
+
+    def _run(self, context, func):
+        self.inside.active = True
+        try:
+            return context.run(func)
+        finally:
+            self.inside.active = False
+
+    #Call every func() concurrently and return their results in order
+    #Waits for all of them; then raises the first error, or returns it in place of the result if return_exceptions is set
+    def gather(self, *funcs, return_exceptions=False):
+        self.gathers += 1
+        self.calls += len(funcs)
+        if len(funcs) < 2 or getattr(self.inside, 'active', False):
+            self.inline += len(funcs)
+            outcomes = []
+            for func in funcs:
+                try:
+                    outcomes.append((True, func()))
+                except Exception as e:
+                    outcomes.append((False, e))
+        else:
+            pool = self._pool()
+            futures = [pool.submit(self._run, contextvars.copy_context(), func) for func in funcs[1:]]
+            #The calling thread does the first call itself instead of sitting idle
+            try:
+                outcomes = [(True, func()) for func in funcs[:1]]
+            except Exception as e:
+                outcomes = [(False, e)]
+            for future in futures:
+                try:
+                    outcomes.append((True, future.result()))
+                except Exception as e:
+                    outcomes.append((False, e))
+
+        results = []
+        for ok, value in outcomes:
+            if not ok and not return_exceptions:
+                raise value
+            results.append(value)
+        return results
+
+    #Drop the pool's threads (e.g. in a freshly forked worker, where they don't exist)
+    def reset(self):
+        with self.lock:
+            self.pool = None
+
+    def shutdown(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def stats(self):
+        return {'workers': self.workers, 'gathers': self.gathers, 'calls': self.calls, 'inline': self.inline}
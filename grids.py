@@ -0,0 +1,33 @@
+import numpy as np
+
+#An attendance or requirement worksheet as two bit-packed boolean matrices (one bit per cell for 'TRUE' and for 'FALSE')
+#Row i is the i-th person under the header; column 0 is the name, column 1 the count, the rest are checkbox columns
+class AttendanceGrid:
+    def __init__(self, values, drop_last=False):
+        #Headers are the non-empty cells of the first row; attendance sheets end with a column that isn't an event
+        headers = [header for header in values[0] if header != ""] if values else []
+        width = max(len(headers) - 1 if drop_last else len(headers), 2)
+        rows = values[1:]
+
+        self.headers = headers
+        self.columns = np.array(headers[2:width], dtype=object)
+        self.names = [row[0] if row else '' for row in rows]
+        self.counts = [row[1] if len(row) > 1 else '' for row in rows]
+
+        cells = np.array([row[2:width] for row in rows], dtype=str).reshape(len(rows), len(self.columns))
+        self.true = np.packbits(cells == 'TRUE', axis=1)
+        self.false = np.packbits(cells == 'FALSE', axis=1)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _row(self, packed, row):
+        return np.unpackbits(packed[row], count=len(self.columns)).astype(bool)
+
+    #Column names checked ('TRUE') for a person
+    def checked(self, row):
+        return list(self.columns[self._row(self.true, row)])
+
+    #Column names explicitly unchecked ('FALSE') for a person
+    def unchecked(self, row):
+        return list(self.columns[self._row(self.false, row)])
@@ -0,0 +1,8 @@
+#Gunicorn reads this file automatically when started from the project directory (see Procfile)
+
+#Import bot.py once in the master; workers are forked with everything already loaded
+preload_app = True
+
+def post_fork(server, worker):
+    import bot
+    bot.after_fork()
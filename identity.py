@@ -0,0 +1,94 @@
+import json
+
+from builds import RosterBuilds
+
+#Return the rows whose name contains the user's first name, narrowed by last initial if more than one matches
+#(the same rule roster_df() used to apply with regexes on every query, but as plain substring checks)
+def match_rows(names, real_name):
+    parts = real_name.lower().split()
+    if not parts:
+        return []
+    rows = [i for i, name in enumerate(names) if parts[0] in name]
+    if len(rows) > 1 and len(parts) > 1:
+        rows = [i for i in rows if parts[1][0] in names[i]]
+    return rows
+
+#Maps each Slack user ID to their row in every roster worksheet, rebuilt only when the roster or the Slack directory changes
+class IdentityIndex:
+    def __init__(self, connect, key, load_worksheets, users, on_report=None):
+        #connect() -> sqlite3 connection, key(url) -> what a build depends on (roster revision & directory version, None if unknown),
+        #load_worksheets(url) -> {title: values}, users() -> [(user_id, real_name)]
+        self.connect = connect
+        self.load_worksheets = load_worksheets
+        self.users = users
+        self.on_report = on_report
+        self.builds = RosterBuilds(connect, 'identity', key, self.build, self._save, self._load)
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS identity_map (roster_url TEXT, worksheet TEXT, user_id TEXT, row INTEGER, PRIMARY KEY (roster_url, worksheet, user_id))''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS identity_reports (roster_url TEXT PRIMARY KEY, report TEXT)''')
+        conn.commit()
+        conn.close()
+
+    #Rebuild now if the roster or the directory changed since the last build, so problems are reported before anyone asks
+    def refresh(self, roster_url):
+        self.builds.get(roster_url)
+
+    #Return the user's data row (0 = first row under the header) in the worksheet, or None if they aren't on it
+    def row(self, roster_url, worksheet, user_id):
+        return self.builds.get(roster_url).get((worksheet, user_id))
+
+    def _save(self, c, roster_url, rows):
+        c.execute('''DELETE FROM identity_map WHERE roster_url = ?''', (roster_url,))
+        c.executemany('''INSERT INTO identity_map (roster_url, worksheet, user_id, row) VALUES (?, ?, ?, ?)''',
+                      [(roster_url, title, user_id, row) for (title, user_id), row in rows.items()])
+
+    def _load(self, c, roster_url):
+        return {(worksheet, user_id): row for worksheet, user_id, row in c.execute('''SELECT worksheet, user_id, row FROM identity_map WHERE roster_url = ?''', (roster_url,))}
+
+    def build(self, roster_url):
+        worksheets = self.load_worksheets(roster_url)
+        users = [(user_id, real_name) for user_id, real_name in self.users() if real_name.strip()]
+
+        rows = {}
+        ambiguous = {}
+        roster_names = set()
+        matched_names = set()
+        matches_by_column = {}
+        for title, values in worksheets.items():
+            names = tuple((row[0] if row else '').strip().lower() for row in values[1:])
+            #Most worksheets list the same people in the same order, so match each distinct name column once
+            if names not in matches_by_column:
+                matches_by_column[names] = {user_id: found for user_id, real_name in users if (found := match_rows(names, real_name))}
+            matches = matches_by_column[names]
+            for user_id, found in matches.items():
+                rows[(title, user_id)] = found[0]
+                matched_names.update(names[i] for i in found)
+                if len(found) > 1:
+                    ambiguous.setdefault(user_id, []).append(title)
+            if matches:
+                roster_names.update(name for name in names if name)
+
+        report = {'ambiguous': ambiguous, 'unmatched': sorted(roster_names - matched_names)}
+        self._report(roster_url, report)
+        return rows
+
+    #Only tell the admins when the list of problems changes
+    def _report(self, roster_url, report):
+        text = json.dumps(report, sort_keys=True)
+        conn = self.connect()
+        c = conn.cursor()
+        previous = c.execute('''SELECT report FROM identity_reports WHERE roster_url = ?''', (roster_url,)).fetchone()
+        c.execute('''INSERT OR REPLACE INTO identity_reports (roster_url, report) VALUES (?, ?)''', (roster_url, text))
+        conn.commit()
+        conn.close()
+        if self.on_report is not None and (report['ambiguous'] or report['unmatched']):
+            if previous is None or previous[0] != text:
+                self.on_report(report)
+
+    #Forget every build for a roster (e.g. when the roster link changes)
+    def invalidate(self, roster_url=None):
+        self.builds.invalidate(roster_url)
+
+    def stats(self):
+        return {url: {'key': key, 'rows': len(rows)} for url, (key, rows) in self.builds.loaded().items()}
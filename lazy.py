@@ -0,0 +1,23 @@
+import threading
+
+#A value built by factory() the first time it is needed, once per process
+class Lazy:
+    def __init__(self, factory):
+        self.factory = factory
+        self.value = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def get(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.value = self.factory()
+                    self.loaded = True
+        return self.value
+
+    #Forget the value so the next get() builds a new one (e.g. in a freshly forked worker)
+    def reset(self):
+        with self.lock:
+            self.value = None
+            self.loaded = False
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+
+#Columns of the links table that can be read or updated
+LINK_COLUMNS = ('events_url', 'roster_url', 'budget_url')
+
+#Serves one chapter's links row from memory; each worker checks a version counter at most every few seconds to pick up updates
+#Each Slack team has its own row; the original single row (team_id NULL) belongs to the default chapter
+class LinkConfig:
+    def __init__(self, connect, check_interval=None, on_change=None, team_id=None):
+        #connect() -> sqlite3 connection, on_change(column, old_link, new_link) is called whenever a link changes
+        self.connect = connect
+        self.team_id = team_id
+        self.check_interval = check_interval if check_interval is not None else float(os.getenv('LINKS_CHECK_INTERVAL', 5))
+        self.on_change = on_change
+        self.links = None
+        self.version = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+        conn = self.connect()
+        #Databases from before chapters had their own links get the column, with the existing row left to the default chapter
+        columns = [row[1] for row in conn.execute('''PRAGMA table_info(links)''')]
+        if columns and 'team_id' not in columns:
+            conn.execute('''ALTER TABLE links ADD COLUMN team_id TEXT''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS links_version (id INTEGER PRIMARY KEY, version INTEGER)''')
+        conn.execute('''INSERT OR IGNORE INTO links_version (id, version) VALUES (1, 0)''')
+        conn.commit()
+        conn.close()
+
+    def get(self, column):
+        if self.links is None or time.monotonic() - self.checked > self.check_interval:
+            self.refresh()
+        return self.links.get(column)
+
+    #Reload the links row if another worker has changed any chapter's links since we last looked
+    def refresh(self, force=False):
+        with self.lock:
+            conn = self.connect()
+            c = conn.cursor()
+            version = c.execute('''SELECT version FROM links_version WHERE id = 1''').fetchone()[0]
+            changed = []
+            if force or self.links is None or version != self.version:
+                row = c.execute(f'''SELECT {', '.join(LINK_COLUMNS)} FROM links WHERE team_id IS ? ORDER BY id LIMIT 1''', (self.team_id,)).fetchone()
+                links = dict(zip(LINK_COLUMNS, row)) if row is not None else {}
+                if self.links is not None:
+                    changed = [(column, self.links.get(column), links.get(column)) for column in LINK_COLUMNS if self.links.get(column) != links.get(column)]
+                self.links = links
+                self.version = version
+            conn.close()
+            self.checked = time.monotonic()
+        self._notify(changed)
+
+    #Store a new link with parameterized queries and bump the version so other workers reload
+    def set(self, column, link):
+        if column not in LINK_COLUMNS:
+            raise ValueError(f"Unknown link column: {column}")
+        self.refresh()
+        with self.lock:
+            conn = self.connect()
+            c = conn.cursor()
+            row = c.execute('''SELECT id FROM links WHERE team_id IS ? ORDER BY id LIMIT 1''', (self.team_id,)).fetchone()
+            if row is None:
+                c.execute(f'''INSERT INTO links (team_id, {column}) VALUES (?, ?)''', (self.team_id, link))
+            else:
+                c.execute(f'''UPDATE links SET {column} = ? WHERE id = ?''', (link, row[0]))
+            c.execute('''UPDATE links_version SET version = version + 1 WHERE id = 1''')
+            self.version = c.execute('''SELECT version FROM links_version WHERE id = 1''').fetchone()[0]
+            conn.commit()
+            conn.close()
+            old = self.links.get(column)
+            self.links = dict(self.links, **{column: link})
+        self._notify([(column, old, link)])
+
+    def _notify(self, changed):
+        if self.on_change is None:
+            return
+        for column, old, new in changed:
+            self.on_change(column, old, new)
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+from datetime import datetime
+
+from cache import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+#Stands in for a gspread Worksheet when reading from the mirror (only the title is needed)
+class MirroredWorksheet:
+    def __init__(self, title):
+        self.title = title
+
+    def __repr__(self):
+        return f"<MirroredWorksheet {self.title!r}>"
+
+#Local SQLite copy of whole spreadsheets, kept in sync by a background job
+#A sync first compares the spreadsheet's Drive revision, then rewrites only the worksheets whose contents changed
+class SheetMirror:
+    def __init__(self, connect, open_spreadsheet, revision, on_change=None, fanout=None):
+        #connect() -> sqlite3 connection, open_spreadsheet(url) -> gspread Spreadsheet,
+        #revision(url) -> Drive modifiedTime, on_change(url, changed_titles) after a sync writes something,
+        #fanout -> FanOut used to make independent Google calls at the same time
+        self.connect = connect
+        self.open_spreadsheet = open_spreadsheet
+        self.revision = revision
+        self.on_change = on_change
+        self.fanout = fanout
+        #Concurrent syncs of the same spreadsheet share one download
+        self.flights = SingleFlight()
+
+        self.syncs = 0
+        self.worksheets_written = 0
+        self.last_error = None
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS mirror_spreadsheets (url TEXT PRIMARY KEY, revision TEXT, synced_at TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS mirror_worksheets (url TEXT, title TEXT, position INTEGER, content_hash TEXT, worksheet_values TEXT, PRIMARY KEY (url, title))''')
+        conn.commit()
+        conn.close()
+
+    #Copy any changed worksheets of a spreadsheet into the mirror; returns the titles that changed
+    def sync(self, url):
+        return self.flights.do(url, lambda: self._sync_and_notify(url))
+
+    def _sync_and_notify(self, url):
+        try:
+            changed = self._sync(url)
+        except Exception as e:
+            #Keep serving the last good copy if Sheets is unavailable
+            self.last_error = f"{datetime.now().isoformat()} {url}: {e!r}"
+            logger.exception("Mirror sync failed for %s", url)
+            raise
+        if changed and self.on_change is not None:
+            self.on_change(url, changed)
+        return changed
+
+    def _revision(self, url):
+        try:
+            return self.revision(url)
+        except Exception:
+            return None
+
+    def _sync(self, url):
+        self.syncs += 1
+        conn = self.connect()
+        c = conn.cursor()
+        stored = c.execute('''SELECT revision FROM mirror_spreadsheets WHERE url = ?''', (url,)).fetchone()
+
+        #A spreadsheet that was never mirrored has to be downloaded anyway, so open it while the revision is fetched
+        spreadsheet = None
+        if stored is None and self.fanout is not None:
+            revision, spreadsheet = self.fanout.gather(lambda: self._revision(url), lambda: self.open_spreadsheet(url))
+        else:
+            revision = self._revision(url)
+
+        now = datetime.now().isoformat()
+        if stored is not None and revision is not None and stored[0] == revision:
+            c.execute('''UPDATE mirror_spreadsheets SET synced_at = ? WHERE url = ?''', (now, url))
+            conn.commit()
+            conn.close()
+            return []
+
+        #gspread is only imported once a sync actually has to download something
+        from sheets import get_worksheets_values
+
+        worksheets = (spreadsheet or self.open_spreadsheet(url)).worksheets()
+        values = get_worksheets_values(worksheets)
+        hashes = dict(c.execute('''SELECT title, content_hash FROM mirror_worksheets WHERE url = ?''', (url,)).fetchall())
+
+        changed = []
+        content_hashes = []
+        for position, worksheet in enumerate(worksheets):
+            text = json.dumps(values[worksheet.title])
+            content_hash = hashlib.sha1(text.encode()).hexdigest()
+            content_hashes.append(content_hash)
+            if hashes.get(worksheet.title) == content_hash:
+                c.execute('''UPDATE mirror_worksheets SET position = ? WHERE url = ? AND title = ?''', (position, url, worksheet.title))
+            else:
+                c.execute('''INSERT OR REPLACE INTO mirror_worksheets (url, title, position, content_hash, worksheet_values) VALUES (?, ?, ?, ?, ?)''',
+                          (url, worksheet.title, position, content_hash, text))
+                changed.append(worksheet.title)
+        removed = set(hashes) - {worksheet.title for worksheet in worksheets}
+        c.executemany('''DELETE FROM mirror_worksheets WHERE url = ? AND title = ?''', [(url, title) for title in removed])
+        changed.extend(removed)
+
+        #Without a Drive revision, the contents themselves tell other workers whether anything changed
+        if revision is None:
+            revision = hashlib.sha1(''.join(content_hashes).encode()).hexdigest()
+        c.execute('''INSERT OR REPLACE INTO mirror_spreadsheets (url, revision, synced_at) VALUES (?, ?, ?)''', (url, revision, now))
+        conn.commit()
+        conn.close()
+        self.worksheets_written += len(changed) - len(removed)
+        return changed
+
+    def _ensure_synced(self, url):
+        conn = self.connect()
+        synced = conn.execute('''SELECT 1 FROM mirror_spreadsheets WHERE url = ?''', (url,)).fetchone()
+        conn.close()
+        if synced is None:
+            self.sync(url)
+
+    #Worksheets of a mirrored spreadsheet, in sheet order
+    def worksheets(self, url):
+        self._ensure_synced(url)
+        conn = self.connect()
+        titles = conn.execute('''SELECT title FROM mirror_worksheets WHERE url = ? ORDER BY position''', (url,)).fetchall()
+        conn.close()
+        return [MirroredWorksheet(title) for title, in titles]
+
+    #{title: values} for several worksheets of a mirrored spreadsheet
+    def values_many(self, url, titles):
+        self._ensure_synced(url)
+        conn = self.connect()
+        placeholders = ', '.join('?' for _ in titles)
+        rows = conn.execute(f'''SELECT title, worksheet_values FROM mirror_worksheets WHERE url = ? AND title IN ({placeholders})''', (url, *titles)).fetchall()
+        conn.close()
+        values = {title: json.loads(text) for title, text in rows}
+        for title in titles:
+            if title not in values:
+                from gspread.exceptions import WorksheetNotFound
+                raise WorksheetNotFound(title)
+        return values
+
+    def values(self, url, title):
+        return self.values_many(url, [title])[title]
+
+    #Revision of the mirrored copy (what the caches compare against), or None if never synced
+    def mirrored_revision(self, url):
+        conn = self.connect()
+        row = conn.execute('''SELECT revision FROM mirror_spreadsheets WHERE url = ?''', (url,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    #When the mirror last confirmed it matched Google Sheets
+    def synced_at(self, url):
+        conn = self.connect()
+        row = conn.execute('''SELECT synced_at FROM mirror_spreadsheets WHERE url = ?''', (url,)).fetchone()
+        conn.close()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def stats(self):
+        return {'syncs': self.syncs, 'worksheets_written': self.worksheets_written, 'last_error': self.last_error, 'coalescing': self.flights.stats()}
@@ -0,0 +1,336 @@
+import heapq
+import itertools
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from urllib.error import URLError
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+logger = logging.getLogger(__name__)
+
+#requests adapter that connects with the client's SSLContext (WebClient(ssl=...)) instead of requests' own CA bundle
+def ssl_context_adapter(ssl_context, **kwargs):
+    from requests.adapters import HTTPAdapter
+
+    class SSLContextAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **pool_kwargs):
+            pool_kwargs['ssl_context'] = ssl_context
+            return super().init_poolmanager(*args, **pool_kwargs)
+
+        def proxy_manager_for(self, proxy, **proxy_kwargs):
+            proxy_kwargs['ssl_context'] = ssl_context
+            return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+        #The context decides whether & against which CAs certificates are checked
+        def cert_verify(self, conn, url, verify, cert):
+            super().cert_verify(conn, url, verify, cert)
+            conn.cert_reqs = 'CERT_NONE' if ssl_context.verify_mode == ssl.CERT_NONE else 'CERT_REQUIRED'
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+
+    return SSLContextAdapter(**kwargs)
+
+#WebClient that keeps its HTTPS connections to slack.com open between calls instead of reconnecting for every message
+class PooledWebClient(WebClient):
+    def __init__(self, *args, pool_size=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_size = pool_size or int(os.getenv('SLACK_POOL_SIZE', 4))
+        self.session = None
+        self.session_lock = threading.Lock()
+
+    #The session (and its sockets) are opened on the first call, so a client created before a fork isn't shared
+    def open_session(self):
+        import requests
+
+        with self.session_lock:
+            if self.session is None:
+                session = requests.Session()
+                if self.ssl is not None:
+                    session.mount('https://', ssl_context_adapter(self.ssl, pool_connections=1, pool_maxsize=self.pool_size))
+                else:
+                    session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                self.session = session
+            return self.session
+
+    #Drop pooled connections (call in a forked child so it doesn't reuse its parent's sockets)
+    def reset_session(self):
+        self.session = None
+
+    #Same contract as WebClient's urllib transport: {status, headers, body}; errors like 429 come back as a status
+    #Network errors are raised as the exceptions urllib would raise, so WebClient's retry handlers (which retry URLError) still apply
+    def _perform_urllib_http_request_internal(self, url, req):
+        import requests
+
+        session = self.session or self.open_session()
+        proxies = {'http': self.proxy, 'https': self.proxy} if self.proxy else None
+        try:
+            response = session.post(url, data=req.data, headers=dict(req.header_items()), timeout=self.timeout, proxies=proxies)
+        except requests.exceptions.ReadTimeout as e:
+            #Not retried, as with urllib: the call may have gone through
+            raise socket.timeout(str(e)) from e
+        except requests.exceptions.ConnectionError as e:
+            raise URLError(e) from e
+        #admin.analytics.getFile answers with a gzip file
+        if response.headers.get('Content-Type', '').startswith('application/gzip'):
+            return {'status': response.status_code, 'headers': response.headers, 'body': response.content}
+        return {'status': response.status_code, 'headers': response.headers, 'body': response.text}
+
+#Seconds Slack asked us to wait, or None if the error isn't a rate limit
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None or response.status_code != 429:
+        return None
+    return float(response.headers.get('Retry-After', 1))
+
+#One queued Slack call
+class Message:
+    def __init__(self, method, kwargs, not_before=0.0, placeholder=None):
+        self.future = Future()
+        self.method = method
+        self.kwargs = kwargs
+        self.not_before = not_before
+        #For chat.update: the queued post whose ts we are replacing
+        self.placeholder = placeholder
+        self.attempts = 0
+
+#Delivers outgoing Slack messages from a per-channel queue
+#Posts to a channel are spaced by channel_interval (Slack allows about one message per second per channel),
+#a 429 pauses every channel for the Retry-After it asks for, and messages in a channel are always sent in order
+class SlackOutbox:
+    def __init__(self, client, channel_interval=None, workers=None, max_attempts=None):
+        self.client = client
+        self.channel_interval = channel_interval if channel_interval is not None else float(os.getenv('SLACK_CHANNEL_INTERVAL', 1.0))
+        self.workers = workers or int(os.getenv('SLACK_OUTBOX_WORKERS', 4))
+        self.max_attempts = max_attempts or int(os.getenv('SLACK_MAX_ATTEMPTS', 5))
+
+        self.queues = {}
+        #(ready time, seq, channel) for channels with messages waiting & nobody sending; stale entries are skipped
+        self.ready = []
+        self.scheduled = {}
+        self.busy = set()
+        self.next_post = {}
+        self.paused_until = 0.0
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.threads = []
+        self.stopping = False
+
+        #User ID -> DM channel ID; a user's DM channel never changes
+        self.dm_channels = {}
+        self.dm_lock = threading.Lock()
+
+        #Counters for the stats endpoint
+        self.calls = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.placeholders_skipped = 0
+        self.dm_cache_hits = 0
+
+    def start(self):
+        with self.cond:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"slack-outbox-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    #Queue a chat.postMessage; the future resolves to the Slack response
+    def post(self, channel, text, delay=0.0, **kwargs):
+        return self._enqueue(channel, Message('chat_postMessage', dict(kwargs, channel=channel, text=text), time.monotonic() + delay))
+
+    #Queue a "working on it" message that is only sent if replace() isn't called within `delay` seconds
+    def placeholder(self, channel, text, delay=None):
+        delay = delay if delay is not None else float(os.getenv('SLACK_PLACEHOLDER_DELAY', 0.5))
+        return self.post(channel, text, delay=delay)
+
+    #Send the real answer in place of a placeholder: a normal post if the placeholder never went out, otherwise chat.update
+    def replace(self, channel, placeholder, text, **kwargs):
+        if placeholder.cancel():
+            self.placeholders_skipped += 1
+            with self.cond:
+                queue = self.queues.get(channel)
+                if queue:
+                    self.queues[channel] = deque(message for message in queue if message.future is not placeholder)
+            return self.post(channel, text, **kwargs)
+        return self._enqueue(channel, Message('chat_update', dict(kwargs, channel=channel, text=text), placeholder=placeholder))
+
+    #Queue a chat.update of a message that has already been sent
+    def update(self, channel, ts, text, **kwargs):
+        return self._enqueue(channel, Message('chat_update', dict(kwargs, channel=channel, ts=ts, text=text)))
+
+    #Post to a user's DM channel
+    def post_dm(self, user_id, text, **kwargs):
+        return self.post(self.dm_channel(user_id), text, **kwargs)
+
+    def dm_channel(self, user_id):
+        channel = self.dm_channels.get(user_id)
+        if channel is not None:
+            self.dm_cache_hits += 1
+            return channel
+        with self.dm_lock:
+            if user_id not in self.dm_channels:
+                response = self._call_with_retries(self.client.conversations_open, users=[user_id])
+                self.dm_channels[user_id] = response["channel"]["id"]
+            return self.dm_channels[user_id]
+
+    def _call_with_retries(self, method, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            self._wait_for_pause()
+            try:
+                self.calls += 1
+                return method(**kwargs)
+            except SlackApiError as e:
+                wait = retry_after(e)
+                if wait is None or attempt == self.max_attempts:
+                    raise
+                self._pause(wait)
+
+    def _wait_for_pause(self):
+        with self.cond:
+            while self.paused_until > time.monotonic():
+                self.cond.wait(self.paused_until - time.monotonic())
+
+    def _pause(self, seconds):
+        with self.cond:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.cond.notify_all()
+
+    def _enqueue(self, channel, message):
+        if not self.threads:
+            self.start()
+        with self.cond:
+            self.queues.setdefault(channel, deque()).append(message)
+            self._schedule(channel)
+        return message.future
+
+    #When the channel's next message may go out (call with the lock held)
+    def _ready_at(self, channel):
+        message = self.queues[channel][0]
+        ready = max(message.not_before, self.paused_until)
+        if message.method == 'chat_postMessage':
+            ready = max(ready, self.next_post.get(channel, 0.0))
+        return ready
+
+    def _schedule(self, channel):
+        if channel in self.busy or not self.queues.get(channel):
+            return
+        ready = self._ready_at(channel)
+        if self.scheduled.get(channel) == ready:
+            return
+        self.scheduled[channel] = ready
+        heapq.heappush(self.ready, (ready, next(self.seq), channel))
+        self.cond.notify_all()
+
+    #Wait for the next channel that is allowed to send and take its first message
+    def _next(self):
+        with self.cond:
+            while True:
+                if self.stopping and not self.ready:
+                    return None, None
+                if not self.ready:
+                    self.cond.wait()
+                    continue
+                ready, _, channel = self.ready[0]
+                if self.scheduled.get(channel) != ready or channel in self.busy or not self.queues.get(channel):
+                    heapq.heappop(self.ready)
+                    continue
+                #The head may have been cancelled, or a pause may have started since it was scheduled
+                actual = self._ready_at(channel)
+                if actual != ready:
+                    heapq.heappop(self.ready)
+                    del self.scheduled[channel]
+                    self._schedule(channel)
+                    continue
+                wait = ready - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.ready)
+                del self.scheduled[channel]
+                self.busy.add(channel)
+                return channel, self.queues[channel].popleft()
+
+    def _run(self):
+        while True:
+            channel, message = self._next()
+            if channel is None:
+                return
+            requeue = False
+            try:
+                #A message retried after a rate limit is already running
+                if message.future.running() or message.future.set_running_or_notify_cancel():
+                    requeue = self._send(message)
+            finally:
+                with self.cond:
+                    if requeue:
+                        self.queues[channel].appendleft(message)
+                    elif message.method == 'chat_postMessage' and not message.future.cancelled():
+                        self.next_post[channel] = time.monotonic() + self.channel_interval
+                    self.busy.discard(channel)
+                    if not self.queues.get(channel):
+                        self.queues.pop(channel, None)
+                    else:
+                        self._schedule(channel)
+                    self.cond.notify_all()
+
+    #Make the call; returns True if it should be retried after a rate limit
+    def _send(self, message):
+        method, kwargs = message.method, message.kwargs
+        if message.placeholder is not None:
+            try:
+                kwargs = dict(kwargs, ts=message.placeholder.result()['ts'])
+            except Exception:
+                #The placeholder never made it, so post the answer instead
+                method = 'chat_postMessage'
+        message.attempts += 1
+        try:
+            self.calls += 1
+            message.future.set_result(getattr(self.client, method)(**kwargs))
+        except SlackApiError as e:
+            wait = retry_after(e)
+            if wait is not None and message.attempts < self.max_attempts:
+                self._pause(wait)
+                return True
+            self._fail(message, e)
+        except Exception as e:
+            self._fail(message, e)
+        return False
+
+    def _fail(self, message, error):
+        self.failed += 1
+        logger.error("Slack %s to %s failed: %r", message.method, message.kwargs.get('channel'), error)
+        message.future.set_exception(error)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'queued': sum(len(queue) for queue in self.queues.values()),
+                'channels': len(self.queues),
+                'calls': self.calls,
+                'rate_limited': self.rate_limited,
+                'failed': self.failed,
+                'placeholders_skipped': self.placeholders_skipped,
+                'dm_channels_cached': len(self.dm_channels),
+                'dm_cache_hits': self.dm_cache_hits,
+            }
+
+    #Deliver what's queued (up to the timeout), then stop the threads
+    def shutdown(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.queues and time.monotonic() < deadline:
+                self.cond.wait(min(deadline - time.monotonic(), 0.1))
+            self.stopping = True
+            self.ready.clear()
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
@@ -0,0 +1,126 @@
+import json
+import os
+import time
+import uuid
+
+#Slack allows at most 3000 characters in a section's text & 50 blocks in a message
+SECTION_CHARS = 3000
+MAX_BLOCKS = 50
+
+#action_id of the button that loads the next page of a reply
+MORE_ACTION = 'reply_more'
+
+#A long answer as an intro, a list of items (one line each: an event, a requirement, a heading...) & a footer,
+#rendered as Block Kit pages instead of one big message: the intro goes on the first page, the footer on the last
+class Reply:
+    def __init__(self, intro='', items=(), footer=''):
+        self.intro = intro
+        self.items = list(items)
+        self.footer = footer
+
+    #The whole answer as plain mrkdwn (what a single message used to contain)
+    def text(self):
+        return '\n'.join(part for part in (self.intro, '\n'.join(self.items), self.footer) if part)
+
+    def __str__(self):
+        return self.text()
+
+    def to_json(self):
+        return json.dumps({'intro': self.intro, 'items': self.items, 'footer': self.footer})
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(data['intro'], data['items'], data['footer'])
+
+    #Split into pages of at most per_page items; each page is (blocks, fallback text)
+    def pages(self, per_page=None):
+        per_page = per_page or int(os.getenv('REPLY_PAGE_ITEMS', 15))
+        chunks = [self.items[start:start + per_page] for start in range(0, len(self.items), per_page)] or [[]]
+        pages = []
+        for number, items in enumerate(chunks):
+            parts = ([self.intro] if number == 0 and self.intro else []) + ['\n'.join(items)] + ([self.footer] if number == len(chunks) - 1 and self.footer else [])
+            blocks = [section for part in parts for section in sections(part)][:MAX_BLOCKS - 2]
+            if len(chunks) > 1:
+                blocks.append({'type': 'context', 'elements': [{'type': 'mrkdwn', 'text': f"Page {number + 1} of {len(chunks)}"}]})
+            pages.append((blocks, '\n'.join(part for part in parts if part)))
+        return pages
+
+#mrkdwn section blocks for a piece of text, split on line breaks to stay under Slack's per-section limit
+def sections(text):
+    blocks = []
+    current = ''
+    for line in text.split('\n'):
+        #A single line longer than a section is cut
+        line = line[:SECTION_CHARS]
+        if current and len(current) + 1 + len(line) > SECTION_CHARS:
+            blocks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current.strip():
+        blocks.append(current)
+    return [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': block}} for block in blocks]
+
+#The button at the bottom of every page but the last
+def more_button(reply_id, page, remaining):
+    return {'type': 'actions', 'elements': [{'type': 'button', 'action_id': MORE_ACTION, 'value': f"{reply_id}:{page}",
+                                             'text': {'type': 'plain_text', 'text': f"Show more ({remaining} more page{'s' if remaining > 1 else ''})"}}]}
+
+#Pages of replies that are still being read, stored in SQLite so whichever worker gets the button click can send the next one
+class PageStore:
+    def __init__(self, connect, ttl=None):
+        #connect() -> sqlite3 connection
+        self.connect = connect
+        self.ttl = ttl if ttl is not None else float(os.getenv('REPLY_PAGES_TTL', 7 * 24 * 60 * 60))
+
+        self.saved = 0
+        self.served = 0
+        self.expired = 0
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS reply_pages (reply_id TEXT, page INTEGER, blocks TEXT, fallback TEXT, created_at REAL, PRIMARY KEY (reply_id, page))''')
+        conn.commit()
+        conn.close()
+
+    #Store a reply's pages (with "more" buttons added) & return them; single-page replies aren't stored
+    def save(self, pages):
+        if len(pages) < 2:
+            return pages
+        reply_id = uuid.uuid4().hex
+        pages = [(blocks + [more_button(reply_id, number + 1, len(pages) - number - 1)] if number < len(pages) - 1 else blocks, fallback)
+                 for number, (blocks, fallback) in enumerate(pages)]
+        now = time.time()
+        conn = self.connect()
+        conn.executemany('''INSERT INTO reply_pages (reply_id, page, blocks, fallback, created_at) VALUES (?, ?, ?, ?, ?)''',
+                         [(reply_id, number, json.dumps(blocks), fallback, now) for number, (blocks, fallback) in enumerate(pages)])
+        conn.commit()
+        conn.close()
+        self.saved += 1
+        return pages
+
+    #(blocks, fallback text) of a stored page, or None if it has expired
+    def get(self, reply_id, page):
+        conn = self.connect()
+        row = conn.execute('''SELECT blocks, fallback FROM reply_pages WHERE reply_id = ? AND page = ? AND created_at > ?''',
+                           (reply_id, page, time.time() - self.ttl)).fetchone()
+        conn.close()
+        if row is None:
+            self.expired += 1
+            return None
+        self.served += 1
+        return json.loads(row[0]), row[1]
+
+    #Drop pages nobody can ask for anymore (run by the scheduler)
+    def purge(self):
+        conn = self.connect()
+        conn.execute('''DELETE FROM reply_pages WHERE created_at <= ?''', (time.time() - self.ttl,))
+        conn.commit()
+        conn.close()
+
+    def stats(self):
+        return {'replies_saved': self.saved, 'pages_served': self.served, 'expired': self.expired}
+
+#Blocks of a page without its "more" button (once the next page has been sent)
+def without_button(blocks):
+    return [block for block in blocks if block.get('type') != 'actions']
@@ -0,0 +1,81 @@
+import os
+import time
+
+#Rendered answers to per-user questions ("what requirements do I have"), keyed by (spreadsheet, intent, user)
+#An entry is only served while revision(url) is what it was rendered from (e.g. the roster revision & Slack directory version),
+#so an edit to the sheet, a directory change or a new link retires it automatically; entries also expire after `ttl` seconds
+#Stored in SQLite so every worker process shares them
+#render() must read its data at the current revision (i.e. its caches revalidate against the same revision(url));
+#an answer is only stored if the revision didn't move while it was being rendered
+class ResponseCache:
+    def __init__(self, connect, revision, ttl=None):
+        #connect() -> sqlite3 connection, revision(url) -> version of everything answers are rendered from (None if unknown)
+        self.connect = connect
+        self.revision = revision
+        self.ttl = ttl if ttl is not None else float(os.getenv('RESPONSE_CACHE_TTL', 24 * 60 * 60))
+
+        self.hits = 0
+        self.misses = 0
+        self.not_stored = 0
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS response_cache (url TEXT, intent TEXT, user_id TEXT, revision TEXT, response TEXT, rendered_at REAL, PRIMARY KEY (url, intent, user_id))''')
+        conn.commit()
+        conn.close()
+
+    #Return the cached answer for the current revision, or render(), store & return a new one
+    def get(self, url, intent, user_id, render):
+        revision = self.revision(url) if url else None
+        if revision is None:
+            #Rendering the first answer is what mirrors the spreadsheet, so its revision is known afterwards
+            self.misses += 1
+            response = render()
+            revision = self.revision(url) if url else None
+            if revision is not None:
+                self._store(url, intent, user_id, revision, response)
+            return response
+
+        conn = self.connect()
+        row = conn.execute('''SELECT response FROM response_cache WHERE url = ? AND intent = ? AND user_id = ? AND revision = ? AND rendered_at > ?''',
+                           (url, intent, user_id, revision, time.time() - self.ttl)).fetchone()
+        conn.close()
+        if row is not None:
+            self.hits += 1
+            return row[0]
+
+        self.misses += 1
+        response = render()
+        if self.revision(url) == revision:
+            self._store(url, intent, user_id, revision, response)
+        else:
+            #The spreadsheet changed mid-render, so the answer may mix both revisions
+            self.not_stored += 1
+        return response
+
+    def _store(self, url, intent, user_id, revision, response):
+        conn = self.connect()
+        conn.execute('''INSERT OR REPLACE INTO response_cache (url, intent, user_id, revision, response, rendered_at) VALUES (?, ?, ?, ?, ?, ?)''',
+                     (url, intent, user_id, revision, response, time.time()))
+        conn.commit()
+        conn.close()
+
+    #Drop every answer rendered from a spreadsheet (e.g. when the bot is pointed at a different one)
+    def invalidate(self, url):
+        conn = self.connect()
+        conn.execute('''DELETE FROM response_cache WHERE url = ?''', (url,))
+        conn.commit()
+        conn.close()
+
+    #Drop answers that can no longer be served (run by the scheduler)
+    def purge(self):
+        conn = self.connect()
+        conn.execute('''DELETE FROM response_cache WHERE rendered_at <= ?''', (time.time() - self.ttl,))
+        conn.commit()
+        conn.close()
+
+    def stats(self):
+        conn = self.connect()
+        entries = conn.execute('''SELECT COUNT(*) FROM response_cache''').fetchone()[0]
+        conn.close()
+        total = self.hits + self.misses
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses, 'not_stored': self.not_stored, 'hit_ratio': round(self.hits / total, 3) if total else None}
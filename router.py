@@ -0,0 +1,117 @@
+import re
+
+from lazy import Lazy
+
+#Turn a trie of regex tokens into one regex ('' marks the end of a word)
+def trie_pattern(node):
+    branches = [token + trie_pattern(child) if token else '' for token, child in node.items()]
+    if len(branches) == 1:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')'
+
+#better_profanity checks each word of a message against ~900 VaryingStrings in a Python loop (~10 ms per message)
+#This answers the same `word in CENSOR_WORDSET` question with one compiled regex, so results are identical
+class CompiledWordset:
+    def __init__(self, words, char_map):
+        #Build a trie of character classes so the regex shares common prefixes instead of trying 900 alternatives in turn
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                token = '[' + ''.join(re.escape(c) for c in char_map[char]) + ']' if char in char_map else re.escape(char)
+                node = node.setdefault(token, {})
+            node[''] = {}
+        self.words = words
+        self.pattern = re.compile(trie_pattern(trie))
+
+    def __contains__(self, word):
+        return isinstance(word, str) and self.pattern.fullmatch(word) is not None
+
+    def __len__(self):
+        return len(self.words)
+
+#Loading better_profanity & compiling its wordset takes ~50 ms, so it waits for the first message that gets this far
+def load_profanity():
+    from better_profanity import Profanity
+
+    profanity = Profanity()
+    profanity.CENSOR_WORDSET = CompiledWordset([str(word) for word in profanity.CENSOR_WORDSET], profanity.CHARS_MAPPING)
+    not_allowed = re.compile('[^' + re.escape(''.join(sorted(profanity.ALLOWED_CHARACTERS))) + ']+')
+    return profanity, not_allowed
+
+profanity = Lazy(load_profanity)
+
+#Same answer as profanity.contains_profanity(text)
+#Every word better_profanity tests is a piece of the text, either as written or with the separators between words dropped,
+#so if neither contains a swear word we can skip its word-by-word parsing
+def contains_profanity(text):
+    checker, not_allowed = profanity.get()
+    pattern = checker.CENSOR_WORDSET.pattern
+    text = text.lower()
+    if pattern.search(text) is None and pattern.search(not_allowed.sub('', text)) is None:
+        return False
+    return checker.contains_profanity(text)
+
+#Intent table, in order of precedence: (name, keyword groups, extra check)
+#An intent matches when every group has at least one keyword in the lowercased text and the extra check (if any) passes
+INTENTS = [
+    ('upcoming_events', [['upcoming event', 'upcoming chapter event', 'events coming up', 'future event', 'future chapter event']], None),
+    ('update_events', [['update the events calendar', 'update events calendar', 'update calendar', 'update calendar of event', 'update event', 'update the event']], None),
+    ('slay', [['slay']], None),
+    ('requirements_report', [['who is behind', "who's behind", 'report', 'summary', 'completion rate'], ['requirement', 'credit']], None),
+    ('absences_report', [['who has', "who's", 'report', 'summary', 'too many'], ['absence', 'absent']], None),
+    ('requirements', [['how many', 'which', 'what'], ['requirements', 'credits']], None),
+    ('update_roster', [['update the roster', 'update roster', 'update brother list', 'update brother roster']], None),
+    ('zoom', [['chapter zoom', 'zoom link', 'zoom meeting']], None),
+    ('mailtime', [['mailtime', 'mail time']], None),
+    ('update_budget', [['update the budget', 'update budget', 'update the chapter budget', 'update chapter budget']], None),
+    ('budget', [['budget', 'budget spreadsheet', 'budget sheet', 'budget google sheet']], None),
+    ('todays_event', [['what', 'where', 'when'], ["today's event", "todays event", "today's events", "todays events", "today's chapter event", "today's chapter event", "todays chapter event", "today"]], None),
+    ('ritual_attendance', [['how many', 'which', 'what'], ['ritual', 'tradition']], None),
+    ('chapter_attendance', [['how many', 'which', 'what'], ['chapter meeting', 'meeting', 'chapter event', 'event'], ['missed', 'attended', 'gone to', 'shown up', 'showed up']], None),
+    ('thanks', [['thank', 'thanks', 'thx', 'ty']], None),
+    ('profanity', [], contains_profanity),
+    ('joke', [['joke']], None),
+    ('fact', [['random fact', 'a fact', 'fact']], None),
+    ('bye', [['bye', 'goodbye', 'cya', 'see ya', 'see you', 'later', 'adios', 'farewell']], None),
+    ('goodnight', [['goodnight', 'gn', 'night', 'good night']], None),
+    ('good_morning', [['good morning', 'gm', 'morning', 'goodmorning']], None),
+    ('how_are_you', [['how are you', 'how are u', 'how r u', 'how you doin', 'how u doin']], None),
+    ('hello', [['hi', 'hello', 'howdy', 'hola', 'hey']], None),
+]
+
+#Matches every intent's keywords in a single scan of the text
+#All keywords are compiled into one regex; a lookahead at every position finds the longest keyword starting there,
+#and each keyword also counts every shorter keyword it contains, so overlapping keywords are never missed
+class IntentRouter:
+    def __init__(self, intents=INTENTS):
+        groups = []
+        self.intents = []
+        for name, keyword_groups, check in intents:
+            needed = 0
+            for keywords in keyword_groups:
+                groups.append(keywords)
+                needed |= 1 << (len(groups) - 1)
+            self.intents.append((name, needed, check))
+
+        keywords = sorted({keyword for group in groups for keyword in group}, key=len, reverse=True)
+        #Bitmask of every group satisfied when a keyword is found (including groups of keywords inside it)
+        self.masks = {}
+        for keyword in keywords:
+            mask = 0
+            for i, group in enumerate(groups):
+                if any(other in keyword for other in group):
+                    mask |= 1 << i
+            self.masks[keyword] = mask
+        self.pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in keywords) + '))')
+
+    #Return the name of the first intent (in table order) that the text matches, or None
+    def route(self, text):
+        text = (text or '').lower()
+        found = 0
+        for keyword in set(self.pattern.findall(text)):
+            found |= self.masks[keyword]
+        for name, needed, check in self.intents:
+            if found & needed == needed and (check is None or check(text)):
+                return name
+        return None
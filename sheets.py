@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from gspread.exceptions import APIError
+from gspread.utils import absolute_range_name, fill_gaps
+
+#Grab several worksheets of one spreadsheet in a single values:batchGet request
+def batch_get_values(spreadsheet, titles):
+    response = spreadsheet.values_batch_get([absolute_range_name(title) for title in titles])
+    value_ranges = response.get('valueRanges', [])
+    #batchGet leaves out trailing empty cells, so pad rows the same way get_all_values() does
+    return {title: fill_gaps(value_range.get('values', [])) for title, value_range in zip(titles, value_ranges)}
+
+#Grab several worksheets at the same time, one request per worksheet
+def get_values_concurrently(worksheets, max_workers=8):
+    if not worksheets:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(worksheets), max_workers)) as pool:
+        values = pool.map(lambda worksheet: worksheet.get_all_values(), worksheets)
+        return {worksheet.title: value for worksheet, value in zip(worksheets, values)}
+
+#Grab several worksheets one after another (the old behaviour, kept for benchmarks)
+def get_values_serially(worksheets):
+    return {worksheet.title: worksheet.get_all_values() for worksheet in worksheets}
+
+#Grab several worksheets in one round trip if possible, otherwise concurrently
+def get_worksheets_values(worksheets):
+    if not worksheets:
+        return {}
+    #Worksheet-like objects that only provide get_all_values() can't be batched
+    if not hasattr(worksheets[0], 'spreadsheet'):
+        return get_values_concurrently(worksheets)
+    try:
+        return batch_get_values(worksheets[0].spreadsheet, [worksheet.title for worksheet in worksheets])
+    except APIError:
+        return get_values_concurrently(worksheets)
@@ -0,0 +1,184 @@
+import argparse
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+#Token bucket for one chapter's share of an API quota (Google Sheets is per project, so chapters split it)
+#acquire() blocks until the call fits in the budget; a budget of 0 calls per minute means unlimited
+class RateBudget:
+    def __init__(self, per_minute):
+        self.per_minute = per_minute or 0
+        self.tokens = float(self.per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.calls = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def acquire(self):
+        if not self.per_minute:
+            self.calls += 1
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.calls += 1
+                    if waited:
+                        self.throttled += 1
+                        self.waited += waited
+                    return waited
+                wait = (1 - self.tokens) * 60 / self.per_minute
+            time.sleep(wait)
+            waited += wait
+
+    def stats(self):
+        return {'per_minute': self.per_minute, 'calls': self.calls, 'throttled': self.throttled, 'waited_seconds': round(self.waited, 3)}
+
+#One chapter (Slack workspace) served by this deployment, with its own configuration & budgets
+#The bot attaches the chapter's own clients & caches in its setup callback (links, client, outbox, user_directory, sheet_cache, bot_id)
+class Tenant:
+    def __init__(self, team_id, bot_token=None, bot_user_id=None, admin_ids=(), cache_bytes=None, sheets_per_minute=None, slack_per_minute=None):
+        self.team_id = team_id
+        self.bot_token = bot_token
+        self.bot_user_id = bot_user_id
+        self.admin_ids = list(admin_ids)
+        self.cache_bytes = cache_bytes or int(os.getenv('SHEETS_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+        self.sheets_budget = RateBudget(sheets_per_minute if sheets_per_minute is not None else int(os.getenv('TENANT_SHEETS_PER_MINUTE', 60)))
+        self.slack_budget = RateBudget(slack_per_minute if slack_per_minute is not None else int(os.getenv('TENANT_SLACK_PER_MINUTE', 0)))
+
+    def __repr__(self):
+        return f"<Tenant {self.team_id or 'default'}>"
+
+#The chapters this deployment serves, from the tenants table
+#With no rows the bot runs as a single chapter (the default tenant, configured from the environment) for whichever workspace it is in;
+#once chapters are added, events from teams that aren't in the table are ignored
+class TenantRegistry:
+    def __init__(self, connect, setup, check_interval=None):
+        #connect() -> sqlite3 connection, setup(tenant) attaches the tenant's clients & caches
+        self.connect = connect
+        self.setup = setup
+        self.check_interval = check_interval if check_interval is not None else float(os.getenv('TENANTS_CHECK_INTERVAL', 30))
+        self.tenants = {}
+        self.configured = None
+        self.checked = 0.0
+        self.default = None
+        self.lock = threading.RLock()
+        self.current_tenant = contextvars.ContextVar('tenant', default=None)
+
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS tenants (team_id TEXT PRIMARY KEY, bot_token TEXT, bot_user_id TEXT, admin_ids TEXT,
+                        cache_bytes INTEGER, sheets_per_minute INTEGER, slack_per_minute INTEGER)''')
+        conn.commit()
+        conn.close()
+
+    #Re-read the tenants table at most every check_interval seconds, so new chapters are picked up without a restart
+    def _refresh(self):
+        if self.configured is not None and time.monotonic() - self.checked < self.check_interval:
+            return
+        conn = self.connect()
+        rows = conn.execute('''SELECT team_id, bot_token, bot_user_id, admin_ids, cache_bytes, sheets_per_minute, slack_per_minute FROM tenants''').fetchall()
+        conn.close()
+        self.configured = {row[0]: row for row in rows}
+        self.checked = time.monotonic()
+
+    def _build(self, tenant):
+        self.setup(tenant)
+        return tenant
+
+    #The single chapter served when the tenants table is empty
+    def default_tenant(self):
+        with self.lock:
+            if self.default is None:
+                admin_ids = [user_id.strip() for user_id in os.getenv('BOT_ADMIN_IDS', '').split(',') if user_id.strip()]
+                self.default = self._build(Tenant(None, os.getenv('SLACK_BOT_TOKEN'), os.getenv('SLACK_BOT_USER_ID'), admin_ids))
+            return self.default
+
+    #The tenant for a Slack team ID, or None if this deployment doesn't serve that team
+    def get(self, team_id):
+        with self.lock:
+            self._refresh()
+            if not self.configured:
+                return self.default_tenant()
+            tenant = self.tenants.get(team_id)
+            if tenant is None and team_id in self.configured:
+                _, bot_token, bot_user_id, admin_ids, cache_bytes, sheets_per_minute, slack_per_minute = self.configured[team_id]
+                tenant = self.tenants[team_id] = self._build(Tenant(team_id, bot_token, bot_user_id, json.loads(admin_ids or '[]'),
+                                                                    cache_bytes, sheets_per_minute, slack_per_minute))
+            if tenant is None:
+                logger.warning("Ignoring an event from team %s, which isn't in the tenants table", team_id)
+            return tenant
+
+    #Every tenant this deployment serves (for scheduled jobs)
+    def all(self):
+        with self.lock:
+            self._refresh()
+            if not self.configured:
+                return [self.default_tenant()]
+            return [self.get(team_id) for team_id in sorted(self.configured)]
+
+    #Tenants already set up in this process (without creating any)
+    def loaded(self):
+        with self.lock:
+            return [tenant for tenant in [self.default, *self.tenants.values()] if tenant is not None]
+
+    #The tenant the current request or job is for (the default tenant outside of one)
+    def current(self):
+        return self.current_tenant.get() or self.default_tenant()
+
+    @contextmanager
+    def use(self, tenant):
+        token = self.current_tenant.set(tenant)
+        try:
+            yield tenant
+        finally:
+            self.current_tenant.reset(token)
+
+#Add or update a chapter: python tenants.py add T0123 --token xoxb-... --admins U01,U02
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default='database.db')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add')
+    add.add_argument('team_id')
+    add.add_argument('--token', required=True)
+    add.add_argument('--bot-user-id')
+    add.add_argument('--admins', default='', help='comma-separated Slack user IDs (the only people who can change the chapter\'s links)')
+    add.add_argument('--cache-bytes', type=int)
+    add.add_argument('--sheets-per-minute', type=int)
+    add.add_argument('--slack-per-minute', type=int)
+    remove = commands.add_parser('remove')
+    remove.add_argument('team_id')
+    commands.add_parser('list')
+    args = parser.parse_args()
+
+    registry = TenantRegistry(lambda: sqlite3.connect(args.database), setup=lambda tenant: None)
+    conn = registry.connect()
+    if args.command == 'add':
+        admins = [user_id.strip() for user_id in args.admins.split(',') if user_id.strip()]
+        conn.execute('''INSERT OR REPLACE INTO tenants (team_id, bot_token, bot_user_id, admin_ids, cache_bytes, sheets_per_minute, slack_per_minute)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (args.team_id, args.token, args.bot_user_id, json.dumps(admins), args.cache_bytes, args.sheets_per_minute, args.slack_per_minute))
+    elif args.command == 'remove':
+        conn.execute('''DELETE FROM tenants WHERE team_id = ?''', (args.team_id,))
+    else:
+        for team_id, admin_ids, cache_bytes, sheets_per_minute, slack_per_minute in conn.execute(
+                '''SELECT team_id, admin_ids, cache_bytes, sheets_per_minute, slack_per_minute FROM tenants ORDER BY team_id'''):
+            print(f"{team_id}  admins={admin_ids}  cache_bytes={cache_bytes or 'default'}  sheets/min={sheets_per_minute or 'default'}  slack/min={slack_per_minute or 'default'}")
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    main()
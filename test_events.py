@@ -0,0 +1,71 @@
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+#The bot keeps its state in database.db in the working directory, so import it from an empty one
+os.environ.setdefault('SLACK_SIGNING_SECRET', 'test-secret')
+os.environ.setdefault('SLACK_BOT_USER_ID', 'UBOT')
+os.environ.setdefault('BOT_SCHEDULER', 'off')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp())
+import bot
+
+#Message events posted to /slack/events the way Slack signs them: python -m unittest test_events
+class MessageEventTest(unittest.TestCase):
+    def setUp(self):
+        self.client = bot.app.test_client()
+        self.submit = mock.patch.object(bot.work_queue, 'submit_as', return_value=True).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def post(self, event, headers=None):
+        body = json.dumps({'type': 'event_callback', 'event': event})
+        timestamp = str(int(time.time()))
+        signature = 'v0=' + hmac.new(os.environ['SLACK_SIGNING_SECRET'].encode(), f"v0:{timestamp}:{body}".encode(), hashlib.sha256).hexdigest()
+        headers = dict(headers or {}, **{'X-Slack-Request-Timestamp': timestamp, 'X-Slack-Signature': signature})
+        return self.client.post('/slack/events', data=body, content_type='application/json', headers=headers)
+
+    def test_message_is_queued(self):
+        self.assertEqual(self.post({'type': 'message', 'user': 'U1', 'text': 'hello', 'channel': 'C1', 'ts': '1.1'}).status_code, 200)
+        self.assertEqual(self.submit.call_count, 1)
+
+    def test_edit_of_our_own_message_is_ignored(self):
+        #What Slack sends after chat.update replaces a placeholder or removes a page's button
+        event = {'type': 'message', 'subtype': 'message_changed', 'channel': 'C1', 'ts': '2.1', 'hidden': True,
+                 'message': {'type': 'message', 'user': 'UBOT', 'text': 'The answer', 'ts': '1.2'}}
+        self.assertEqual(self.post(event).status_code, 200)
+        self.assertEqual(self.submit.call_count, 0)
+
+    def test_message_without_text_is_ignored(self):
+        self.post({'type': 'message', 'subtype': 'message_deleted', 'channel': 'C1', 'ts': '3.1', 'hidden': True})
+        self.post({'type': 'message', 'user': 'U1', 'channel': 'C1', 'ts': '3.2'})
+        self.assertEqual(self.submit.call_count, 0)
+
+    def test_bot_messages_are_ignored(self):
+        self.post({'type': 'message', 'user': 'UBOT', 'text': 'hello', 'channel': 'C1', 'ts': '4.1'})
+        self.assertEqual(self.submit.call_count, 0)
+
+    def test_timeout_retry_is_dropped(self):
+        self.post({'type': 'message', 'user': 'U1', 'text': 'hello', 'channel': 'C1', 'ts': '5.1'},
+                  {'X-Slack-Retry-Num': '1', 'X-Slack-Retry-Reason': 'http_timeout'})
+        self.assertEqual(self.submit.call_count, 0)
+
+    def test_retry_of_a_lost_delivery_is_handled(self):
+        for reason in ('connection_failed', 'ssl_error', 'unknown_error', 'http_error'):
+            self.post({'type': 'message', 'user': 'U1', 'text': 'hello', 'channel': 'C1', 'ts': f"6.{len(reason)}"},
+                      {'X-Slack-Retry-Num': '1', 'X-Slack-Retry-Reason': reason})
+        self.assertEqual(self.submit.call_count, 4)
+
+    def test_retry_of_a_handled_message_is_deduplicated(self):
+        event = {'type': 'message', 'user': 'U1', 'text': 'hello', 'channel': 'C1', 'ts': '7.1'}
+        self.post(event)
+        self.post(event, {'X-Slack-Retry-Num': '1', 'X-Slack-Retry-Reason': 'connection_failed'})
+        self.assertEqual(self.submit.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import ssl
+import time
+import unittest
+from unittest import mock
+from urllib.error import URLError
+
+from fakes import FakeSlackServer
+from outbox import PooledWebClient, SlackOutbox
+
+#SlackOutbox & its pooled client against a local fake of the Slack Web API: python -m unittest test_outbox
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.slack = FakeSlackServer(latency=0.01)
+        self.client = PooledWebClient(token='xoxb-test', base_url=self.slack.base_url)
+        self.outbox = SlackOutbox(self.client, channel_interval=0.2, workers=4)
+
+    def tearDown(self):
+        self.outbox.shutdown()
+        if self.client.session is not None:
+            self.client.session.close()
+        self.slack.shutdown()
+
+    #(time received, arguments) of every call of a method the fake received
+    def received(self, method):
+        return [(at, arguments) for at, name, arguments in self.slack.messages if name == method]
+
+    def test_placeholder_replaced_before_it_is_sent(self):
+        placeholder = self.outbox.placeholder('C1', 'Working on it', delay=0.5)
+        self.outbox.replace('C1', placeholder, 'The answer').result(5)
+        time.sleep(0.7)
+
+        self.assertTrue(placeholder.cancelled())
+        self.assertEqual([arguments['text'] for _, arguments in self.received('chat.postMessage')], ['The answer'])
+        self.assertEqual(self.received('chat.update'), [])
+        self.assertEqual(self.outbox.stats()['placeholders_skipped'], 1)
+
+    def test_placeholder_sent_then_updated(self):
+        placeholder = self.outbox.placeholder('C1', 'Working on it', delay=0)
+        ts = placeholder.result(5)['ts']
+        self.outbox.replace('C1', placeholder, 'The answer').result(5)
+
+        self.assertEqual([arguments['text'] for _, arguments in self.received('chat.postMessage')], ['Working on it'])
+        self.assertEqual([(arguments['ts'], arguments['text']) for _, arguments in self.received('chat.update')], [(ts, 'The answer')])
+
+    def test_rate_limited_messages_are_requeued_in_order(self):
+        self.slack.rate_limit = 2
+        self.outbox.channel_interval = 0
+        futures = [self.outbox.post(channel, f"{channel} message {i}") for i in range(2) for channel in ('C1', 'C2', 'C3')]
+        for future in futures:
+            self.assertTrue(future.result(10)['ok'])
+
+        self.assertGreaterEqual(self.slack.rate_limited, 1)
+        self.assertGreaterEqual(self.outbox.stats()['rate_limited'], 1)
+        self.assertEqual(self.outbox.stats()['failed'], 0)
+        for channel in ('C1', 'C2', 'C3'):
+            texts = [arguments['text'] for _, arguments in self.received('chat.postMessage') if arguments['channel'] == channel]
+            self.assertEqual(texts, [f"{channel} message 0", f"{channel} message 1"])
+
+    def test_posts_to_a_channel_are_spaced(self):
+        futures = [self.outbox.post(channel, f"{channel} message {i}") for i in range(3) for channel in ('C1', 'C2')]
+        for future in futures:
+            future.result(5)
+
+        times = {channel: [at for at, arguments in self.received('chat.postMessage') if arguments['channel'] == channel] for channel in ('C1', 'C2')}
+        for channel, sent in times.items():
+            self.assertEqual(len(sent), 3)
+            self.assertGreaterEqual(min(later - earlier for earlier, later in zip(sent, sent[1:])), 0.19, channel)
+        #Other channels don't wait for C1's spacing
+        self.assertLess(times['C2'][0], times['C1'][1])
+
+    def test_connection_errors_are_retried_by_the_web_client(self):
+        client = PooledWebClient(token='xoxb-test', base_url='http://127.0.0.1:1/api/')
+        with mock.patch.object(client, '_perform_urllib_http_request_internal', wraps=client._perform_urllib_http_request_internal) as transport:
+            with self.assertRaises(URLError):
+                client.auth_test()
+        #The default ConnectionErrorRetryHandler tries once more
+        self.assertEqual(transport.call_count, 2)
+
+    def test_ssl_context_is_used_for_https(self):
+        context = ssl.create_default_context()
+        client = PooledWebClient(token='xoxb-test', ssl=context)
+        adapter = client.open_session().get_adapter('https://slack.com/api/')
+        self.assertIs(adapter.poolmanager.connection_pool_kw['ssl_context'], context)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+#Latency buckets (seconds) shared by every histogram
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+#Prometheus counters & histograms kept in memory and rendered in the text exposition format
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, help, amount=1, /, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.help.setdefault(name, help)
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, help, seconds, /, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.help.setdefault(name, help)
+            series = self.histograms.setdefault(name, {})
+            buckets, total, count = series.get(key) or ([0] * len(BUCKETS), 0.0, 0)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            series[key] = (buckets, total + seconds, count + 1)
+
+    #A value read when /metrics is scraped; func() returns a number or {labels tuple: number}
+    def gauge(self, name, help, func):
+        with self.lock:
+            self.help[name] = help
+            self.gauges[name] = func
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            histograms = {name: dict(series) for name, series in self.histograms.items()}
+            gauges = dict(self.gauges)
+        for name, series in sorted(counters.items()):
+            lines += [f"# HELP {name} {self.help[name]}", f"# TYPE {name} counter"]
+            lines += [f"{name}{format_labels(key)} {value}" for key, value in sorted(series.items())]
+        for name, series in sorted(histograms.items()):
+            lines += [f"# HELP {name} {self.help[name]}", f"# TYPE {name} histogram"]
+            for key, (buckets, total, count) in sorted(series.items()):
+                for bound, bucket in zip(BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {bucket}")
+                lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{format_labels(key)} {total}")
+                lines.append(f"{name}_count{format_labels(key)} {count}")
+        for name, func in sorted(gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines += [f"# HELP {name} {self.help[name]}", f"# TYPE {name} gauge"]
+            series = value if isinstance(value, dict) else {(): value}
+            lines += [f"{name}{format_labels(key)} {float(number)}" for key, number in sorted(series.items())]
+        return '\n'.join(lines) + '\n'
+
+#Everything recorded while handling one request
+class Trace:
+    def __init__(self, name, sampled, tags):
+        self.name = name
+        self.sampled = sampled
+        self.tags = dict(tags)
+        self.started = time.perf_counter()
+        self.spans = []
+        self.calls = {}
+        self.external_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record(self):
+        return {
+            'event': 'request',
+            'name': self.name,
+            **self.tags,
+            'duration_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'external_calls': self.calls,
+            'external_ms': round(self.external_seconds * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'spans': self.spans,
+        }
+
+#Per-request tracing: spans for processing stages & external calls, tagged with the intent and cache hits/misses
+#Counters & latency histograms are kept for every request; span details and the log line only for sampled ones
+class Tracer:
+    def __init__(self, metrics=None, sample_rate=None, logger=None):
+        self.metrics = metrics or Metrics()
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+        self.logger = logger or logging.getLogger('bot.requests')
+        self.current = contextvars.ContextVar('trace', default=None)
+
+    @contextmanager
+    def request(self, name, **tags):
+        trace = Trace(name, random.random() < self.sample_rate, tags)
+        token = self.current.set(trace)
+        try:
+            yield trace
+        except Exception:
+            trace.tags['error'] = True
+            raise
+        finally:
+            self.current.reset(token)
+            seconds = time.perf_counter() - trace.started
+            intent = trace.tags.get('intent') or 'none'
+            self.metrics.inc('bot_requests_total', 'Requests handled, by intent', name=name, intent=intent)
+            self.metrics.observe('bot_request_seconds', 'Time to handle a request, by intent', seconds, name=name, intent=intent)
+            if trace.sampled:
+                self.logger.info(json.dumps(trace.record(), default=str))
+
+    #Add tags (e.g. the intent) to the current request
+    def tag(self, **tags):
+        trace = self.current.get()
+        if trace is not None:
+            trace.tags.update(tags)
+
+    @contextmanager
+    def span(self, stage):
+        trace = self.current.get()
+        if trace is None or not trace.sampled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            trace.spans.append({'stage': stage, 'ms': round(seconds * 1000, 2)})
+            self.metrics.observe('bot_stage_seconds', 'Time spent in each processing stage (sampled requests)', seconds, stage=stage)
+
+    #Time one call to Google or Slack; always counted, whether or not the request is sampled
+    @contextmanager
+    def external(self, service, method):
+        trace = self.current.get()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.metrics.inc('bot_external_calls_total', 'Calls made to external APIs', service=service, method=method)
+            self.metrics.observe('bot_external_seconds', 'Latency of external API calls', seconds, service=service, method=method)
+            if trace is not None:
+                key = f"{service}.{method}"
+                trace.calls[key] = trace.calls.get(key, 0) + 1
+                trace.external_seconds += seconds
+                if trace.sampled:
+                    trace.spans.append({'stage': key, 'ms': round(seconds * 1000, 2), 'external': True})
+
+    def cache(self, hits=0, misses=0):
+        if hits:
+            self.metrics.inc('bot_cache_lookups_total', 'Worksheet cache lookups', hits, result='hit')
+        if misses:
+            self.metrics.inc('bot_cache_lookups_total', 'Worksheet cache lookups', misses, result='miss')
+        trace = self.current.get()
+        if trace is not None:
+            trace.cache_hits += hits
+            trace.cache_misses += misses
+
+    #Decorator: run the function as a span named after it
+    def traced(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.span(func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+
+#Send the per-request JSON lines to stderr unless logging has already been set up for them
+def request_logger(name='bot.requests'):
+    logger = logging.getLogger(name)
+    if not logger.handlers and os.getenv('REQUEST_LOG', 'on') != 'off':
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+#Bounded work queue drained by a fixed pool of threads, so Slack gets its ack right away
+#Jobs are queued per key (the chapter a message came from) and the threads take them round-robin across keys,
+#so one chapter's burst waits behind itself instead of in front of everyone else; a key may hold at most max_per_key queued jobs
+class WorkerPool:
+    def __init__(self, workers=None, max_queue=None, put_timeout=None, max_per_key=None):
+        self.workers = workers or int(os.getenv('BOT_WORKERS', 4))
+        self.max_queue = max_queue or int(os.getenv('BOT_QUEUE_SIZE', 100))
+        self.max_per_key = max_per_key or int(os.getenv('BOT_QUEUE_PER_TENANT', self.max_queue))
+        #How long a request thread will wait for room in the queue before giving up
+        self.put_timeout = put_timeout if put_timeout is not None else float(os.getenv('BOT_QUEUE_PUT_TIMEOUT', 0.05))
+        #key -> queued jobs; the first key is served next
+        self.pending = OrderedDict()
+        self.size = 0
+        self.threads = []
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.started = False
+        self.stopping = False
+
+        #Counters for the stats endpoint
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"bot-worker-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            self.started = True
+
+    #Queue a job; returns False if the queue stayed full for put_timeout (backpressure)
+    def submit(self, func, *args, **kwargs):
+        return self.submit_as(None, func, *args, **kwargs)
+
+    #Queue a job under a key (e.g. a Slack team ID); returns False if the queue or the key's share of it stayed full
+    def submit_as(self, key, func, *args, **kwargs):
+        if self.stopping:
+            return False
+        if not self.started:
+            self.start()
+        deadline = time.monotonic() + self.put_timeout
+        with self.cond:
+            while self.size >= self.max_queue or len(self.pending.get(key, ())) >= self.max_per_key:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.stopping:
+                    self.rejected += 1
+                    return False
+                self.cond.wait(remaining)
+            self.pending.setdefault(key, deque()).append((time.monotonic(), func, args, kwargs))
+            self.size += 1
+            self.submitted += 1
+            self.cond.notify()
+        return True
+
+    #Take the next job round-robin across keys; None once stopping and nothing is left
+    def _take(self):
+        with self.cond:
+            while not self.pending:
+                if self.stopping:
+                    return None
+                self.cond.wait()
+            key, jobs = next(iter(self.pending.items()))
+            item = jobs.popleft()
+            if jobs:
+                self.pending.move_to_end(key)
+            else:
+                del self.pending[key]
+            self.size -= 1
+            #Room for a waiting submit
+            self.cond.notify_all()
+            return item
+
+    def _run(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+            enqueued, func, args, kwargs = item
+            started = time.monotonic()
+            wait = started - enqueued
+            try:
+                func(*args, **kwargs)
+                failed = False
+            except Exception:
+                logger.exception("Background job %s failed", getattr(func, '__name__', func))
+                failed = True
+            with self.lock:
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.total_run += time.monotonic() - started
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+
+    def stats(self):
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                'workers': self.workers,
+                'queue_depth': self.size,
+                'queue_capacity': self.max_queue,
+                'queue_per_key': self.max_per_key,
+                'queued_by_key': {str(key): len(jobs) for key, jobs in self.pending.items()},
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_seconds': self.total_wait / finished if finished else 0.0,
+                'max_wait_seconds': self.max_wait,
+                'avg_run_seconds': self.total_run / finished if finished else 0.0,
+            }
+
+    #Stop taking new jobs, let the queued ones finish, then stop the threads
+    def shutdown(self, timeout=10):
+        with self.cond:
+            if not self.started or self.stopping:
+                return
+            self.stopping = True
+            self.cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))